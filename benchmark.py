@@ -0,0 +1,250 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+import cv2 as cv
+import numpy as np
+from detector import YOLODetector
+from engine import InferenceEngine
+from zones import ZoneSet
+
+
+def parse_cfg(cfg_path):
+    """Return the [net] options and the list of (section, options) layers of a Darknet cfg."""
+    sections = []
+    with open(cfg_path, 'rt') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            if line.startswith('['):
+                sections.append((line.strip('[]'), {}))
+            elif '=' in line:
+                key, value = line.split('=', 1)
+                sections[-1][1][key.strip()] = value.strip()
+    return sections[0][1], sections[1:]
+
+
+def write_random_weights(cfg_path, weights_path, seed=0):
+    """Write a Darknet weights file for cfg_path with He-initialised convolutions and identity batch norm.
+
+    The detections are meaningless, but every layer does the same amount of
+    work as with trained weights, which is all a benchmark needs.
+    """
+    net, layers = parse_cfg(cfg_path)
+    rng = np.random.default_rng(seed)
+    channels = []  # Output channels of every layer so far
+    chunks = [np.array([0, 2, 5], dtype=np.int32).tobytes(), np.array([0], dtype=np.int64).tobytes()]
+    for index, (kind, options) in enumerate(layers):
+        inputs = channels[-1] if channels else int(net.get('channels', 3))
+        if kind == 'convolutional':
+            filters, size = int(options['filters']), int(options['size'])
+            chunks.append(np.zeros(filters, dtype=np.float32).tobytes())  # Biases
+            if int(options.get('batch_normalize', 0)):
+                chunks.append(np.ones(filters, dtype=np.float32).tobytes())  # Scales
+                chunks.append(np.zeros(filters, dtype=np.float32).tobytes())  # Rolling mean
+                chunks.append(np.ones(filters, dtype=np.float32).tobytes())  # Rolling variance
+            fan_in = inputs * size * size
+            weights = rng.normal(0, np.sqrt(2 / fan_in), filters * fan_in).astype(np.float32)
+            chunks.append(weights.tobytes())
+            channels.append(filters)
+        elif kind == 'route':
+            sources = [int(v) for v in options['layers'].split(',')]
+            total = sum(channels[s if s >= 0 else index + s] for s in sources)
+            channels.append(total // int(options.get('groups', 1)))
+        else:
+            channels.append(inputs)
+    with open(weights_path, 'wb') as f:
+        f.write(b''.join(chunks))
+
+
+def synthetic_frames(count, width, height, seed=0):
+    """Noise background with a bright block sliding across it, so successive frames differ."""
+    rng = np.random.default_rng(seed)
+    background = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    frames = []
+    for i in range(count):
+        frame = background.copy()
+        x = (i * width // max(count, 1)) % width
+        cv.rectangle(frame, (x, height // 3), (x + width // 4, 2 * height // 3), (40, 200, 220), cv.FILLED)
+        frames.append(frame)
+    return frames
+
+
+def load_frames(video_path, count):
+    cap = cv.VideoCapture(video_path)
+    frames = []
+    while len(frames) < count:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    if not frames:
+        raise ValueError(f"No frames could be read from {video_path}")
+    return frames
+
+
+def summarize(samples, frames=None):
+    """Latency percentiles in milliseconds, plus fps when frames per sample is given."""
+    samples = np.asarray(samples) * 1000
+    summary = {'mean_ms': float(samples.mean()), 'p50_ms': float(np.percentile(samples, 50)),
+               'p95_ms': float(np.percentile(samples, 95)), 'p99_ms': float(np.percentile(samples, 99))}
+    if frames is not None:
+        summary['fps'] = float(frames * 1000 / samples.mean())
+    return summary
+
+
+def bench_stages(detector, frames, interest_area, warmup=3):
+    """Time each stage of YOLODetector.process_frame separately."""
+    outputNames = detector.getOutputsNames()
+    stages = {name: [] for name in ('blob', 'forward', 'postprocess', 'nms', 'draw', 'aoi_check', 'total')}
+    for i, frame in enumerate(frames[:warmup] + frames):
+        frame = frame.copy()
+        t0 = time.perf_counter()
+        blob = cv.dnn.blobFromImage(frame, 1 / 255, (detector.inpWidth, detector.inpHeight), [0, 0, 0], 1, crop=False)
+        t1 = time.perf_counter()
+        detector.net.setInput(blob)
+        outs = detector.net.forward(outputNames)
+        t2 = time.perf_counter()
+        decoded = detector.decode(outs, frame.shape[1], frame.shape[0])
+        t3 = time.perf_counter()
+        classIDs, confidences, boxes = detector.nms(*decoded)
+        t4 = time.perf_counter()
+        for classID, confidence, box in zip(classIDs, confidences, boxes):
+            detector.drawPred(frame, int(classID), float(confidence), *box.tolist())
+        t5 = time.perf_counter()
+        interest_area.test(boxes)
+        t6 = time.perf_counter()
+        if i < warmup:
+            continue
+        for name, elapsed in zip(stages, (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4, t6 - t5, t6 - t0)):
+            stages[name].append(elapsed)
+    return {name: summarize(samples, 1 if name == 'total' else None) for name, samples in stages.items()}
+
+
+def bench_batch(detector, frames, batch_size, warmup=1):
+    batches = [frames[i:i + batch_size] for i in range(0, len(frames) - batch_size + 1, batch_size)]
+    samples = []
+    for i, batch in enumerate(batches[:warmup] + batches):
+        start = time.perf_counter()
+        detector.detect_batch(batch)
+        if i >= warmup:
+            samples.append(time.perf_counter() - start)
+    return summarize(samples, batch_size)
+
+
+def bench_cameras(detector, frames, num_cameras, max_batch_size, interest_area):
+    """Feed frames from num_cameras threads through a shared InferenceEngine and time every process_frame."""
+    engine = InferenceEngine(detector, max_batch_size=max_batch_size).start()
+    latencies = []
+    lock = threading.Lock()
+
+    def camera(camera_detector):
+        samples = []
+        for frame in frames:
+            start = time.perf_counter()
+            camera_detector.process_frame(frame.copy(), interest_area)
+            samples.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(samples)
+
+    threads = [threading.Thread(target=camera, args=(engine.detector_for_camera(),)) for _ in range(num_cameras)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    summary = summarize(latencies)
+    summary['fps'] = len(latencies) / elapsed
+    return summary
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'commit': commit, 'opencv': cv.__version__, 'numpy': np.__version__, 'python': platform.python_version(),
+            'machine': platform.machine(), 'cpus': os.cpu_count(), 'cv_threads': cv.getNumThreads(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def compare(results, baseline_path):
+    """Print the fps change of every benchmark that also appears in the baseline results."""
+    with open(baseline_path, 'rt') as f:
+        baseline = json.load(f)
+
+    def walk(current, previous, path):
+        if isinstance(current, dict) and isinstance(previous, dict):
+            if 'fps' in current and 'fps' in previous:
+                change = (current['fps'] / previous['fps'] - 1) * 100
+                print(f"{path}: {previous['fps']:.1f} -> {current['fps']:.1f} fps ({change:+.1f}%)")
+            for key in current:
+                if key in previous:
+                    walk(current[key], previous[key], f"{path}/{key}" if path else key)
+
+    walk(results['results'], baseline.get('results', {}), '')
+
+
+def parse_list(text):
+    return [int(v) for v in text.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the detection pipeline")
+    parser.add_argument('--cfg', default='train.cfg')
+    parser.add_argument('--weights', default=None, help="Weights file; random weights are generated when omitted")
+    parser.add_argument('--names', default='obj.names')
+    parser.add_argument('--video', default=None, help="Replay frames from this recording instead of synthetic ones")
+    parser.add_argument('--resolution', default='640x480', help="Synthetic frame size, WIDTHxHEIGHT")
+    parser.add_argument('--frames', type=int, default=50, help="Frames per measurement")
+    parser.add_argument('--sizes', type=parse_list, default=[256, 320, 416], help="Network input sizes")
+    parser.add_argument('--batches', type=parse_list, default=[1, 2, 4], help="Batch sizes")
+    parser.add_argument('--cameras', type=parse_list, default=[1, 2, 4], help="Camera counts")
+    parser.add_argument('--aoi', default='199,194,178,145', help="Interest area x,y,w,h used for the AOI check")
+    parser.add_argument('--out', default='bench_results.json')
+    parser.add_argument('--compare', default=None, help="Earlier results file to compare fps against")
+    args = parser.parse_args()
+
+    interest_area = ZoneSet.from_rect(tuple(int(v) for v in args.aoi.split(',')))
+    if args.video:
+        frames = load_frames(args.video, args.frames)
+    else:
+        width, height = (int(v) for v in args.resolution.lower().split('x'))
+        frames = synthetic_frames(args.frames, width, height)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        weights = args.weights
+        if weights is None:
+            weights = os.path.join(tmp, 'random.weights')
+            write_random_weights(args.cfg, weights)
+
+        results = {}
+        for size in args.sizes:
+            detector = YOLODetector(args.cfg, weights, args.names, inpWidth=size, inpHeight=size)
+            key = f'input_{size}'
+            results[key] = {'stages': bench_stages(detector, frames, interest_area)}
+            results[key]['batch'] = {str(b): bench_batch(detector, frames, b) for b in args.batches}
+            results[key]['cameras'] = {str(n): bench_cameras(detector, frames, n, max(args.batches), interest_area)
+                                       for n in args.cameras}
+            total = results[key]['stages']['total']
+            print(f"input {size}: {total['fps']:.1f} fps, p50 {total['p50_ms']:.1f} ms, p99 {total['p99_ms']:.1f} ms")
+
+    report = {'environment': environment(), 'frames': len(frames), 'frame_shape': list(frames[0].shape),
+              'results': results}
+    with open(args.out, 'wt') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results to {args.out}")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import collections
+import csv
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+# One row of cam_list.csv: stream URL, "x,y,w,h" interest area, "red,yellow,green" relay pins
+CameraConfig = collections.namedtuple('CameraConfig', ['stream_url', 'interest_area', 'pins'])
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def parse_ints(text, count, what, line):
+    try:
+        values = tuple(int(v) for v in text.split(','))
+    except ValueError:
+        raise ConfigError(f"line {line}: {what} must be {count} comma-separated integers, got {text!r}")
+    if len(values) != count:
+        raise ConfigError(f"line {line}: {what} must be {count} comma-separated integers, got {text!r}")
+    return values
+
+
+def load_cameras(csv_path):
+    """Parse and validate cam_list.csv into a list of CameraConfig; raises ConfigError on bad rows."""
+    cameras = []
+    with open(csv_path, 'rt', newline='') as f:
+        for line, row in enumerate(csv.reader(f), 1):
+            row = [field.strip() for field in row]
+            if not row or not row[0] or row[0].startswith('#'):
+                continue
+            interest_area = pins = None
+            if len(row) > 1 and row[1]:
+                interest_area = parse_ints(row[1], 4, 'interest area', line)
+                if min(interest_area) < 0:
+                    raise ConfigError(f"line {line}: interest area {row[1]!r} is not a x,y,w,h rectangle")
+                if interest_area[2] == 0 or interest_area[3] == 0:
+                    interest_area = None  # Saved before anything was drawn: not defined yet
+            if len(row) > 2 and row[2]:
+                pins = parse_ints(row[2], 3, 'relay pins', line)
+                if len(set(pins)) != 3:
+                    raise ConfigError(f"line {line}: relay pins {row[2]!r} must be three different pins")
+            cameras.append(CameraConfig(row[0], interest_area, pins))
+
+    urls = [camera.stream_url for camera in cameras]
+    for url in set(urls):
+        if urls.count(url) > 1:
+            raise ConfigError(f"stream {url} is listed more than once")
+    used = [pin for camera in cameras if camera.pins for pin in camera.pins]
+    for pin in set(used):
+        if used.count(pin) > 1:
+            raise ConfigError(f"relay pin {pin} is used by more than one camera")
+    return cameras
+
+
+def get_camera_streams(csv_path):
+    """Read camera streams, coordinates, and pin numbers from a CSV file."""
+    cameras = load_cameras(csv_path)
+    return ([camera.stream_url for camera in cameras], [camera.interest_area for camera in cameras],
+            [camera.pins for camera in cameras])
+
+
+def update_csv_with_aoi(csv_path, stream_url, new_aoi):
+    """Store new_aoi for stream_url, replacing the file atomically so a crash or a reader never sees half of it."""
+    with open(csv_path, 'rt', newline='') as f:
+        rows = list(csv.reader(f))
+    for row in rows:
+        if row and row[0].strip() == stream_url:
+            if len(row) < 2:
+                row.append('')
+            row[1] = ",".join(map(str, new_aoi))
+            break
+    else:
+        print(f"Stream not found in {csv_path}: {stream_url}")
+        return
+
+    directory = os.path.dirname(os.path.abspath(csv_path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.cam_list.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wt', newline='') as f:
+            csv.writer(f, lineterminator='\n').writerows(rows)
+        shutil.copymode(csv_path, tmp)  # mkstemp creates the file 0600; keep the permissions the CSV had
+        os.replace(tmp, csv_path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    print(f'Saved interest area to CSV for stream: {stream_url}')
+
+
+def diff_cameras(old, new):
+    """Return (added, removed, changed) between two camera lists; changed holds (old, new) pairs of a stream."""
+    old_by_url = {camera.stream_url: camera for camera in old}
+    new_by_url = {camera.stream_url: camera for camera in new}
+    added = [camera for url, camera in new_by_url.items() if url not in old_by_url]
+    removed = [camera for url, camera in old_by_url.items() if url not in new_by_url]
+    changed = [(old_by_url[url], camera) for url, camera in new_by_url.items()
+               if url in old_by_url and old_by_url[url] != camera]
+    return added, removed, changed
+
+
+class ConfigWatcher:
+    """Polls the camera CSV and calls on_change(added, removed, changed) after it changes.
+
+    A file that fails validation is reported and ignored, so a half-edited
+    config never takes a running installation down.
+    """
+
+    def __init__(self, csv_path, on_change, cameras=None, interval=2.0):
+        self.csv_path = csv_path
+        self.on_change = on_change
+        self.interval = interval
+        self.cameras = cameras if cameras is not None else load_cameras(csv_path)
+        self.mtime = self.stat()
+
+    def stat(self):
+        try:
+            stat = os.stat(self.csv_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        return self
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.check()
+
+    def check(self):
+        mtime = self.stat()
+        if mtime is None or mtime == self.mtime:
+            return
+        self.mtime = mtime
+        try:
+            cameras = load_cameras(self.csv_path)
+        except (OSError, ConfigError) as e:
+            print(f"Ignoring invalid camera config {self.csv_path}: {e}")
+            return
+        added, removed, changed = diff_cameras(self.cameras, cameras)
+        self.cameras = cameras
+        if added or removed or changed:
+            print(f"Camera config changed: {len(added)} added, {len(removed)} removed, {len(changed)} updated")
+            self.on_change(added, removed, changed)
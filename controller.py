@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+
+
+def cpu_times():
+    """(busy, total) CPU time of the whole machine from /proc/stat, or None where there is no /proc."""
+    try:
+        with open('/proc/stat', 'rt') as f:
+            fields = f.readline().split()
+    except OSError:
+        return None
+    # cpu user nice system idle iowait irq softirq steal; guest time is already counted in user
+    times = [int(v) for v in fields[1:9]]
+    return sum(times) - times[3] - times[4], sum(times)
+
+
+class LatencyController:
+    """Keeps every camera's capture-to-result latency within a budget.
+
+    Each camera sits on one of levels, (input size, max fps) pairs from best
+    to cheapest; None means no frame rate cap. Every period seconds the
+    controller moves one camera by one level. When a camera is over budget
+    or the machine is short of CPU, it degrades a camera, cameras without a
+    train in their AOI first. When everything is comfortably within budget,
+    it restores a camera, cameras with a train first.
+
+    Handlers need a yolo_detector plus latency, intersection and target_fps
+    attributes.
+    """
+
+    LEVELS = ((416, None), (320, None), (256, None), (256, 5), (256, 2), (256, 1))
+
+    def __init__(self, budget, levels=LEVELS, period=2.0, min_headroom=0.1, upgrade_ratio=0.6):
+        self.budget = budget  # Seconds from capture to relay decision
+        self.levels = levels
+        self.period = period
+        self.min_headroom = min_headroom  # Fraction of total CPU to keep free
+        self.upgrade_ratio = upgrade_ratio  # Only upgrade while every camera is below budget * upgrade_ratio
+        self.handlers = []
+        self.level = {}  # handler -> index into levels
+        self.last_cpu = cpu_times()
+
+    def add(self, handler):
+        self.handlers.append(handler)
+        self.level[handler] = 0
+        self.apply(handler)
+
+    def remove(self, handler):
+        self.handlers = [h for h in self.handlers if h is not handler]  # Replaced, not mutated, under step()
+
+    def apply(self, handler):
+        size, fps = self.levels[self.level[handler]]
+        handler.yolo_detector.inpWidth = handler.yolo_detector.inpHeight = size
+        handler.target_fps = fps
+
+    def headroom(self):
+        """Fraction of all cores left unused since the previous call, by every process on the machine.
+
+        Other processes count too: with --workers the detection runs outside
+        this process, and anything else on the box competes for the same cores.
+        Without /proc the one-minute load average stands in.
+        """
+        cpu = cpu_times()
+        if cpu is None or self.last_cpu is None:
+            self.last_cpu = cpu
+            return 1.0 - os.getloadavg()[0] / (os.cpu_count() or 1)
+        busy, total = cpu[0] - self.last_cpu[0], cpu[1] - self.last_cpu[1]
+        self.last_cpu = cpu
+        return 1.0 - busy / total if total > 0 else 1.0
+
+    def step(self):
+        headroom = self.headroom()
+        if any(handler.latency > self.budget for handler in self.handlers) or headroom < self.min_headroom:
+            candidates = sorted(self.handlers, key=lambda h: (h.intersection, -h.latency))
+            change = 1
+        elif all(handler.latency < self.budget * self.upgrade_ratio for handler in self.handlers) \
+                and headroom > 2 * self.min_headroom:
+            candidates = sorted(self.handlers, key=lambda h: (not h.intersection, h.latency))
+            change = -1
+        else:
+            return
+        for handler in candidates:
+            level = self.level[handler] + change
+            if 0 <= level < len(self.levels):
+                self.level[handler] = level
+                self.apply(handler)
+                size, fps = self.levels[level]
+                print(f"{handler.name}: latency {handler.latency * 1000:.0f} ms, CPU headroom {headroom:.0%}, "
+                      f"now at input {size}" + (f" and {fps} fps" if fps else ""))
+                return
+
+    def run(self):
+        while True:
+            time.sleep(self.period)
+            self.step()
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        return self
@@ -1,52 +1,104 @@
 import cv2 as cv
 import numpy as np
+from metrics import METRICS
+from motion import MotionGate
+from tracker import BoxTracker
+from zones import ZoneSet
 
 class YOLODetector:
-    def __init__(self, modelConf="train.cfg", modelWeights="train_last.weights", classesFile="obj.names", confThreshold=0.5, nmsThreshold=0.1, inpWidth=416, inpHeight=416):
+    def __init__(self, modelConf="train.cfg", modelWeights="train_last.weights", classesFile="obj.names", confThreshold=0.5, nmsThreshold=0.1, inpWidth=416, inpHeight=416, aoiCrop=False, aoiMargin=0.25, minInpSize=128, motionThreshold=None, motionRefresh=25, drawDetections=True, keyframeInterval=None):
         self.confThreshold = confThreshold
         self.nmsThreshold = nmsThreshold
         self.inpWidth = inpWidth
         self.inpHeight = inpHeight
+        self.aoiCrop = aoiCrop  # Infer on the interest area plus aoiMargin instead of the whole frame
+        self.aoiMargin = aoiMargin  # Fraction of the AOI width/height added on each side of the crop
+        self.minInpSize = minInpSize
+        self.motionThreshold = motionThreshold  # Skip inference while the AOI change score stays below this
+        self.motionRefresh = motionRefresh  # Still infer at least once every motionRefresh frames
+        self.drawDetections = drawDetections  # False leaves frames untouched; callers annotate on demand
+        self.keyframeInterval = keyframeInterval  # Run the network every N frames and track boxes in between
         self.classes = None
         with open(classesFile, 'rt') as f:
             self.classes = f.read().rstrip('\n').split('\n')
-        self.net = cv.dnn.readNetFromDarknet(modelConf, modelWeights)
-        self.net.setPreferableBackend(cv.dnn.DNN_BACKEND_OPENCV)
-        self.net.setPreferableTarget(cv.dnn.DNN_TARGET_CPU)
+        self.net = self.load_net(modelConf, modelWeights)
+        self.camera = ''  # Label for the metrics of this detector
+        self.reset_state()
+
+    def reset_state(self):
+        """Reset the per-camera state: intersection counters and motion gating."""
         self.intersection_count = 0
         self.no_detections_count = 0  # Counts frames without detections
+        self.motion_gate = MotionGate(self.motionThreshold, self.motionRefresh) if self.motionThreshold is not None else None
+        self.tracker = BoxTracker(self.keyframeInterval) if self.keyframeInterval is not None else None
+        self.last_detections = None
+        self.frame_size = None  # (width, height) of the last processed frame
+        self.zone_overlaps = None  # (boxes, zones) overlap fractions of the last frame, with a ZoneSet AOI
+        self.zone_hits = None
+        self.box_hits = None  # Per box of the last frame: whether it hits the interest area
 
+    def load_net(self, modelConf, modelWeights):
+        net = cv.dnn.readNetFromDarknet(modelConf, modelWeights)
+        net.setPreferableBackend(cv.dnn.DNN_BACKEND_OPENCV)
+        net.setPreferableTarget(cv.dnn.DNN_TARGET_CPU)
+        return net
 
     def getOutputsNames(self):
         layersNames = self.net.getLayerNames()
         return [layersNames[i - 1] for i in self.net.getUnconnectedOutLayers()]
 
+    def decode_batch(self, outs, frameSizes):
+        """Decode raw YOLO outputs for a batch of frames in whole-array operations.
+
+        outs holds one (batch, rows, 5 + classes) array per output layer and
+        frameSizes one (width, height) pair per frame.  Returns a list with a
+        (classIDs, confidences, boxes) tuple per frame, boxes as left/top/width/height.
+        """
+        detections = np.concatenate([out.reshape(len(frameSizes), -1, out.shape[-1]) for out in outs], axis=1)
+        scores = detections[..., 5:]
+        classIDs = scores.argmax(axis=-1)
+        confidences = np.take_along_axis(scores, classIDs[..., None], axis=-1)[..., 0]
+        keep = confidences > self.confThreshold
+
+        frameIdx, rowIdx = np.nonzero(keep)
+        kept = detections[frameIdx, rowIdx]
+        scale = np.asarray(frameSizes, dtype=np.float32)[frameIdx]
+        centers = (kept[:, 0:2] * scale).astype(np.int32)
+        sizes = (kept[:, 2:4] * scale).astype(np.int32)
+        boxes = np.hstack(((centers - sizes / 2).astype(np.int32), sizes))
+        classIDs, confidences = classIDs[frameIdx, rowIdx], confidences[frameIdx, rowIdx]
+
+        splits = np.cumsum(np.count_nonzero(keep, axis=1))[:-1]
+        return list(zip(np.split(classIDs, splits), np.split(confidences, splits), np.split(boxes, splits)))
+
+    def decode(self, outs, frameWidth, frameHeight):
+        return self.decode_batch([out[None] for out in outs], [(frameWidth, frameHeight)])[0]
+
+    def nms(self, classIDs, confidences, boxes):
+        indices = cv.dnn.NMSBoxes(boxes, confidences, self.confThreshold, self.nmsThreshold)
+        indices = np.asarray(indices, dtype=np.int32).reshape(-1)
+        return classIDs[indices], confidences[indices], boxes[indices]
+
     def postprocess(self, frame, outs, interest_area):
         frameHeight, frameWidth = frame.shape[:2]
-        # print(frameHeight, frameWidth)
-        classIDs, confidences, boxes = [], [], []
-        intersection = False
-
-        for out in outs:
-            for detection in out:
-                # print(detection)
-                scores = detection[5:]
-                classID = np.argmax(scores)
-                confidence = scores[classID]
-                if confidence > self.confThreshold:
-                    centerX, centerY = int(detection[0] * frameWidth), int(detection[1] * frameHeight)
-                    width, height = int(detection[2] * frameWidth), int(detection[3] * frameHeight)
-                    left, top = int(centerX - width / 2), int(centerY - height / 2)
-                    boxes.append([left, top, width, height])
-                    classIDs.append(classID)
-                    confidences.append(float(confidence))
+        detections = self.nms(*self.decode(outs, frameWidth, frameHeight))
+        return self.apply_detections(frame, detections, interest_area)
 
-        indices = cv.dnn.NMSBoxes(boxes, confidences, self.confThreshold, self.nmsThreshold)
-        for i in indices:
-            box = boxes[i]
-            self.drawPred(frame, classIDs[i], confidences[i], *box)
-            if self.check_intersection(box, interest_area):
-                intersection = True
+    def draw_detections(self, frame, detections):
+        for classID, confidence, box in zip(*detections):
+            self.drawPred(frame, int(classID), float(confidence), *box.tolist())
+
+    def apply_detections(self, frame, detections, interest_area):
+        if self.drawDetections:
+            self.draw_detections(frame, detections)
+        self.box_hits = np.zeros(len(detections[2]), dtype=bool)
+        if isinstance(interest_area, ZoneSet):
+            self.zone_overlaps, self.zone_hits = interest_area.test(detections[2])
+            self.box_hits = self.zone_hits.any(axis=1)
+        elif interest_area:
+            self.box_hits = np.array([self.check_intersection(box.tolist(), interest_area) for box in detections[2]],
+                                     dtype=bool)
+        intersection = bool(self.box_hits.any())
 
         if intersection:
             self.intersection_count += 1
@@ -96,9 +148,119 @@ class YOLODetector:
         intersect = ax1 < bx2 and ax2 > bx1 and ay1 < by2 and ay2 > by1
         return intersect
 
-    def process_frame(self, frame, interest_area):
-        blob = cv.dnn.blobFromImage(frame, 1 / 255, (self.inpWidth, self.inpHeight), [0, 0, 0], 1, crop=False)
+    def aoi_rect(self, interest_area):
+        """Return the AOI as (left, top, right, bottom), accepting either right/bottom or width/height."""
+        if isinstance(interest_area, ZoneSet):
+            return interest_area.bounds
+        x1, y1, x2, y2 = interest_area
+        if x2 < x1 or y2 < y1:
+            x2 += x1
+            y2 += y1
+        return x1, y1, x2, y2
+
+    def crop_region(self, frameWidth, frameHeight, interest_area):
+        """Return the AOI grown by aoiMargin as (left, top, right, bottom), clamped to the frame."""
+        x1, y1, x2, y2 = self.aoi_rect(interest_area)
+        marginX, marginY = int((x2 - x1) * self.aoiMargin), int((y2 - y1) * self.aoiMargin)
+        return max(x1 - marginX, 0), max(y1 - marginY, 0), min(x2 + marginX, frameWidth), min(y2 + marginY, frameHeight)
+
+    def crop_input_size(self, width, height):
+        """Network input for a crop: its size rounded up to a multiple of 32, capped at the full input size."""
+        def fit(length, limit):
+            return min(max(-(-length // 32) * 32, self.minInpSize), limit)
+        return fit(width, self.inpWidth), fit(height, self.inpHeight)
+
+    def decode_reduction(self, frameWidth, frameHeight, interest_area):
+        """Largest JPEG decode reduction (8, 4 or 2) that still fills the network input, else 1."""
+        width, height = frameWidth, frameHeight
+        needWidth, needHeight = self.inpWidth, self.inpHeight
+        if self.aoiCrop and interest_area:
+            left, top, right, bottom = self.crop_region(frameWidth, frameHeight, interest_area)
+            if right > left and bottom > top:
+                width, height = right - left, bottom - top
+                needWidth, needHeight = self.crop_input_size(width, height)
+        for reduction in (8, 4, 2):
+            if width // reduction >= needWidth and height // reduction >= needHeight:
+                return reduction
+        return 1
+
+    def detect_batch(self, frames, inpSize=None):
+        """Run one forward pass over several frames and return NMS survivors per frame."""
+        if inpSize is None:
+            inpSize = (self.inpWidth, self.inpHeight)
+        start = METRICS.start()
+        blob = cv.dnn.blobFromImages(frames, 1 / 255, inpSize, [0, 0, 0], 1, crop=False)
+        METRICS.stop(start, 'blob', self.camera)
+        start = METRICS.start()
         self.net.setInput(blob)
         outs = self.net.forward(self.getOutputsNames())
-        processed_frame, intersection = self.postprocess(frame, outs, interest_area)
-        return processed_frame, intersection, self.intersection_count
\ No newline at end of file
+        METRICS.stop(start, 'forward', self.camera)
+        start = METRICS.start()
+        frameSizes = [(frame.shape[1], frame.shape[0]) for frame in frames]
+        detections = [self.nms(*decoded) for decoded in self.decode_batch(outs, frameSizes)]
+        METRICS.stop(start, 'postprocess', self.camera)
+        return detections
+
+    def detect(self, frame, inpSize=None):
+        return self.detect_batch([frame], inpSize)[0]
+
+    def detect_aoi(self, frame, interest_area):
+        left, top, right, bottom = self.crop_region(frame.shape[1], frame.shape[0], interest_area)
+        if right <= left or bottom <= top:
+            return self.detect(frame)
+        crop = frame[top:bottom, left:right]
+        classIDs, confidences, boxes = self.detect(crop, self.crop_input_size(right - left, bottom - top))
+        # Map crop coordinates back to the full frame
+        boxes[:, 0] += left
+        boxes[:, 1] += top
+        return classIDs, confidences, boxes
+
+    def needs_inference(self, frame, interest_area):
+        if self.motion_gate is None:
+            return True
+        if interest_area:
+            left, top, right, bottom = self.crop_region(frame.shape[1], frame.shape[0], interest_area)
+            if right > left and bottom > top:
+                frame = frame[top:bottom, left:right]
+        # Always consult the gate so its background keeps learning
+        infer = self.motion_gate.should_infer(frame, force=self.last_detections is None)
+        METRICS.inc('inferences_run' if infer else 'inferences_skipped', self.camera)
+        return infer
+
+    def rescale_state(self, frameWidth, frameHeight):
+        """Carry detections and tracks over to frames of a new size, e.g. after the JPEG decode scale changed."""
+        oldWidth, oldHeight = self.frame_size
+        scale = np.array([frameWidth / oldWidth, frameHeight / oldHeight] * 2, dtype=np.float32)
+        if self.last_detections is not None:
+            classIDs, confidences, boxes = self.last_detections
+            self.last_detections = classIDs, confidences, np.round(boxes * scale).astype(np.int32)
+        if self.tracker is not None:
+            self.tracker.boxes = self.tracker.boxes * scale
+            self.tracker.velocities = self.tracker.velocities * scale[:2]
+        # The motion gate compares a fixed-size thumbnail of the same region, so it needs no change
+
+    def process_frame(self, frame, interest_area):
+        frameSize = (frame.shape[1], frame.shape[0])
+        if self.frame_size is not None and frameSize != self.frame_size:
+            self.rescale_state(*frameSize)
+        self.frame_size = frameSize
+        start = METRICS.start()
+        if not self.needs_inference(frame, interest_area):
+            # Nothing moved since the last pass: its detections still hold, so counters advance as usual
+            detections = self.last_detections
+        elif self.tracker is not None and not self.tracker.is_keyframe(self.aoi_rect(interest_area) if interest_area else None):
+            detections = self.tracker.predict()
+        else:
+            if self.aoiCrop and interest_area:
+                detections = self.detect_aoi(frame, interest_area)
+            else:
+                detections = self.detect(frame)
+            if self.tracker is not None:
+                self.tracker.update(detections)
+            METRICS.inc('frames_inferred', self.camera)
+        self.last_detections = detections
+        METRICS.stop(start, 'detect', self.camera)
+        start = METRICS.start()
+        processed_frame, intersection = self.apply_detections(frame, detections, interest_area)
+        METRICS.stop(start, 'annotate', self.camera)
+        return processed_frame, intersection, self.intersection_count
@@ -0,0 +1,244 @@
+import argparse
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+import numpy as np
+from metrics import METRICS
+
+# One fixed-size record per detected box, little-endian so logs can be moved between machines
+RECORD = np.dtype([('timestamp', '<f8'), ('camera', '<u2'), ('class_id', '<u2'), ('confidence', '<f4'),
+                   ('left', '<i4'), ('top', '<i4'), ('width', '<i4'), ('height', '<i4'),
+                   ('intersection', 'u1'), ('reserved', 'u1', 3)])
+
+
+def day_key(timestamp):
+    return time.strftime('%Y%m%d', time.gmtime(timestamp))
+
+
+def segment_path(directory, camera, day):
+    return os.path.join(directory, f'cam{camera:03d}', f'{day}.det')
+
+
+def read_segment(path):
+    """Memory-map a segment file; a record cut short by a crash at the end is ignored."""
+    count = os.path.getsize(path) // RECORD.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=RECORD)
+    return np.memmap(path, dtype=RECORD, mode='r', shape=(count,))
+
+
+def read_cameras(directory):
+    """{camera id: {'name': ..., 'url': ...}} from cameras.json; older logs only stored names."""
+    try:
+        with open(os.path.join(directory, 'cameras.json'), 'rt') as f:
+            cameras = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {int(camera): info if isinstance(info, dict) else {'name': info, 'url': None}
+            for camera, info in cameras.items()}
+
+
+class DetectionLog:
+    """Append-only per-camera detection store, written from a background thread.
+
+    Records go to one file per camera per UTC day, each an array of RECORD
+    that can be memory-mapped as is. Every camera has a single writer, so
+    records within a file are in time order: the day in the file name is
+    the coarse time index and a binary search on the timestamp column is
+    the fine one, so a query only reads the days it spans.
+    """
+
+    def __init__(self, directory='detections', flush_interval=1.0, max_queue=10000):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(max_queue)
+        self.records_dropped = 0
+        self.records_written = 0
+        self.last_timestamps = {}  # camera -> newest timestamp written, to keep files sorted
+        self.lock = threading.Lock()
+        self.cameras = {}  # camera id -> {'name': ..., 'url': ...}, as stored in cameras.json
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.cameras = read_cameras(self.directory)
+        threading.Thread(target=self.run, daemon=True).start()
+        return self
+
+    def camera_id(self, stream_url):
+        """Id of stream_url in this log: the one it had before, even in an earlier run, else the next free one."""
+        with self.lock:
+            for camera, info in self.cameras.items():
+                if info['url'] == stream_url:
+                    return camera
+            camera = max(self.cameras, default=-1) + 1
+            self.cameras[camera] = {'name': None, 'url': stream_url}
+            self.save_cameras()
+            return camera
+
+    def name_camera(self, camera, name):
+        with self.lock:
+            if self.cameras[camera]['name'] != name:
+                self.cameras[camera]['name'] = name
+                self.save_cameras()
+
+    def save_cameras(self):
+        # Every id ever handed out stays in the file, so old records keep their stream
+        path = os.path.join(self.directory, 'cameras.json')
+        with open(path + '.tmp', 'wt') as f:
+            json.dump({str(camera): info for camera, info in sorted(self.cameras.items())}, f, indent=1)
+        os.replace(path + '.tmp', path)
+
+    def log(self, camera, timestamp, detections, intersection, scale=1.0):
+        """Queue the (classIDs, confidences, boxes) of one frame; never blocks the caller.
+
+        intersection says per box whether it hits the interest area, e.g. the
+        detector's box_hits; a single bool applies to every box.
+
+        scale is the size of the frame the boxes refer to relative to the
+        stream, e.g. 0.25 for a JPEG decoded at a quarter; records are always
+        stored in stream coordinates.
+        """
+        if detections is None or not len(detections[0]):
+            return
+        try:
+            self.queue.put_nowait((camera, timestamp, detections, intersection, scale))
+        except queue.Full:
+            self.records_dropped += len(detections[0])
+            METRICS.inc('detections_dropped', str(camera), len(detections[0]))
+
+    def records(self, camera, timestamp, detections, intersection, scale=1.0):
+        classIDs, confidences, boxes = detections
+        # Clamp so a wall clock stepping back can't break the time order of the file
+        timestamp = max(timestamp, self.last_timestamps.get(camera, timestamp))
+        self.last_timestamps[camera] = timestamp
+        records = np.zeros(len(classIDs), dtype=RECORD)
+        records['timestamp'] = timestamp
+        records['camera'] = camera
+        records['class_id'] = classIDs
+        records['confidence'] = confidences
+        boxes = np.asarray(boxes).reshape(-1, 4)
+        if scale != 1:
+            boxes = np.round(boxes / scale)
+        records['left'], records['top'], records['width'], records['height'] = boxes.T
+        records['intersection'] = intersection
+        return records
+
+    def run(self):
+        while True:
+            pending = {}  # (camera, day) -> [record arrays]
+            taken = 0
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                try:
+                    item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                taken += 1
+                records = self.records(*item)
+                pending.setdefault((item[0], day_key(records['timestamp'][0])), []).append(records)
+            for (camera, day), chunks in pending.items():
+                path = segment_path(self.directory, camera, day)
+                try:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(path, 'ab') as f:
+                        f.write(np.concatenate(chunks).tobytes())
+                    self.records_written += sum(len(chunk) for chunk in chunks)
+                except OSError as e:
+                    print(f"Detection log write failed for {path}: {e}")
+            for _ in range(taken):
+                self.queue.task_done()
+
+    def join(self):
+        """Block until everything logged so far is on disk."""
+        self.queue.join()
+
+
+class DetectionLogReader:
+    def __init__(self, directory='detections'):
+        self.directory = directory
+
+    def cameras(self):
+        """{camera id: name} of every camera with logs."""
+        names = {camera: info['name'] or info['url'] for camera, info in read_cameras(self.directory).items()}
+        for entry in sorted(os.listdir(self.directory)):
+            if entry.startswith('cam') and entry[3:].isdigit():
+                names.setdefault(int(entry[3:]), entry)
+        return names
+
+    def query(self, camera, start=None, end=None, intersection=None, min_confidence=None):
+        """Records of camera with start <= timestamp < end, as a RECORD array.
+
+        intersection=True/False keeps only records with that flag, e.g.
+        query(3, t1, t2, intersection=True) for all intersections on camera 3.
+        """
+        camera_dir = os.path.dirname(segment_path(self.directory, camera, ''))
+        if not os.path.isdir(camera_dir):
+            return np.zeros(0, dtype=RECORD)
+        first = day_key(start) if start is not None else ''
+        last = day_key(end) if end is not None else '99999999'
+        results = []
+        for name in sorted(os.listdir(camera_dir)):
+            day = name[:-len('.det')]
+            if not name.endswith('.det') or not first <= day <= last:
+                continue
+            records = read_segment(os.path.join(camera_dir, name))
+            timestamps = records['timestamp']
+            lo = np.searchsorted(timestamps, start, 'left') if start is not None else 0
+            hi = np.searchsorted(timestamps, end, 'left') if end is not None else len(records)
+            selected = records[lo:hi]
+            if intersection is not None:
+                selected = selected[selected['intersection'] == bool(intersection)]
+            if min_confidence is not None:
+                selected = selected[selected['confidence'] >= min_confidence]
+            results.append(np.array(selected))  # Copy out of the memory map
+        if not results:
+            return np.zeros(0, dtype=RECORD)
+        return np.concatenate(results)
+
+    def events(self, camera, start=None, end=None, gap=5.0):
+        """Merge intersection records into (start, end) intervals, splitting at gaps over gap seconds."""
+        timestamps = np.unique(self.query(camera, start, end, intersection=True)['timestamp'])
+        if not len(timestamps):
+            return []
+        breaks = np.flatnonzero(np.diff(timestamps) > gap)
+        starts = np.concatenate([timestamps[:1], timestamps[breaks + 1]])
+        ends = np.concatenate([timestamps[breaks], timestamps[-1:]])
+        return list(zip(starts.tolist(), ends.tolist()))
+
+
+def parse_time(text):
+    """Unix seconds, or an ISO date/time taken as UTC unless it has an offset."""
+    try:
+        return float(text)
+    except ValueError:
+        moment = datetime.datetime.fromisoformat(text)
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=datetime.timezone.utc)
+        return moment.timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the detection log")
+    parser.add_argument('camera', type=int)
+    parser.add_argument('--dir', default='detections')
+    parser.add_argument('--start', type=parse_time, default=None, help="Unix time or ISO date/time (UTC)")
+    parser.add_argument('--end', type=parse_time, default=None, help="Unix time or ISO date/time (UTC)")
+    parser.add_argument('--events', action='store_true', help="Print intersection intervals instead of records")
+    args = parser.parse_args()
+
+    reader = DetectionLogReader(args.dir)
+    if args.events:
+        for start, end in reader.events(args.camera, args.start, args.end):
+            print(f"{datetime.datetime.fromtimestamp(start, datetime.timezone.utc).isoformat()} {end - start:.1f} s")
+        return
+    for record in reader.query(args.camera, args.start, args.end):
+        print(f"{record['timestamp']:.3f} class {record['class_id']} {record['confidence']:.2f} "
+              f"box {record['left']},{record['top']},{record['width']},{record['height']} "
+              f"intersection {bool(record['intersection'])}")
+
+
+if __name__ == '__main__':
+    main()
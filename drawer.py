@@ -1,23 +1,5 @@
 import cv2 as cv
-import pandas as pd
-
-def get_camera_streams(csv_path):
-    """Read camera streams and pin numbers from a CSV file."""
-    camera_df = pd.read_csv(csv_path, header=None)
-    camera_streams = camera_df.iloc[:, 0].tolist()
-    camera_cords = [None] * len(camera_streams)
-    camera_pins = []
-
-    if camera_df.shape[1] > 1:
-        for i in range(len(camera_streams)):
-            cords = camera_df.iloc[i, 1]
-            if pd.notna(cords):
-                camera_cords[i] = tuple(map(int, str(cords).split(',')))
-
-    if camera_df.shape[1] > 2:
-        camera_pins = [tuple(map(int, str(pins).split(','))) for pins in camera_df.iloc[:, 2]]
-
-    return camera_streams, camera_cords, camera_pins
+from config import get_camera_streams, update_csv_with_aoi
 
 class CameraAOI:
     def __init__(self, stream_url, window_name):
@@ -82,20 +64,6 @@ def define_interest_areas(csv_path):
         cap.release()
         cv.destroyAllWindows()
 
-def update_csv_with_aoi(csv_path, stream_url, new_aoi):
-    camera_df = pd.read_csv(csv_path, header=None)
-    new_aoi_str = ",".join(map(str, new_aoi))  # Convert new_aoi to a comma-separated string
-
-    for index, row in camera_df.iterrows():
-        if row[0] == stream_url:
-            if camera_df.shape[1] < 2:  # Check if there is a column to store the new_aoi
-                # If not, append a new column
-                camera_df[1] = pd.NA
-            camera_df.at[index, 1] = new_aoi_str  # Store the new_aoi string
-            break
-
-    camera_df.to_csv(csv_path, header=None, index=False)
-    print(f'Saved interest area to CSV for stream: {stream_url}')
 
 if __name__ == '__main__':
     csv_path = 'cam_list.csv'  # Replace with the path to your CSV file
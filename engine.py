@@ -0,0 +1,100 @@
+import threading
+import time
+from detector import YOLODetector
+
+
+class InferenceRequest:
+    def __init__(self, frame, inpSize=None):
+        self.frame = frame
+        self.inpSize = inpSize
+        self.detections = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class InferenceEngine:
+    """Loads the network once and runs batched forward passes for all cameras.
+
+    Cameras submit their latest frame and block until the next tick. Each tick
+    takes up to max_batch_size pending frames, waiting at most max_wait seconds
+    for the remaining cameras to catch up, and runs a single net.forward.
+    """
+
+    def __init__(self, detector=None, max_batch_size=8, max_wait=0.01):
+        self.detector = detector if detector is not None else YOLODetector()
+        self.detector.camera = 'engine'  # Batched stages are shared by all cameras
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.pending = []
+        self.num_clients = 0
+        self.cond = threading.Condition()
+
+    def detector_for_camera(self):
+        with self.cond:
+            self.num_clients += 1
+        return SharedDetector(self)
+
+    def release_detector(self, detector):
+        """Forget a camera's detector, so ticks stop waiting for its frames."""
+        with self.cond:
+            self.num_clients -= 1
+            self.cond.notify_all()
+
+    def infer(self, frame, inpSize=None):
+        request = InferenceRequest(frame, inpSize)
+        with self.cond:
+            self.pending.append(request)
+            self.cond.notify_all()
+        request.done.wait()
+        if request.error is not None:
+            # RuntimeError whatever went wrong, e.g. a cv2.error, as from a WorkerPool
+            raise RuntimeError(f"Batched inference failed: {request.error}") from request.error
+        return request.detections
+
+    def next_batch(self):
+        with self.cond:
+            while not self.pending:
+                self.cond.wait()
+            deadline = time.monotonic() + self.max_wait
+            while len(self.pending) < min(self.max_batch_size, self.num_clients):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            # Frames cropped to different network input sizes can't share a blob
+            inpSize = self.pending[0].inpSize
+            batch = [request for request in self.pending if request.inpSize == inpSize][:self.max_batch_size]
+            self.pending = [request for request in self.pending if request not in batch]
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            try:
+                results = self.detector.detect_batch([request.frame for request in batch], batch[0].inpSize)
+            except Exception as e:
+                print(f"Batched inference failed: {e}")
+                for request in batch:
+                    request.error = e
+                    request.done.set()
+                continue
+            for request, detections in zip(batch, results):
+                request.detections = detections
+                request.done.set()
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        return self
+
+
+class SharedDetector(YOLODetector):
+    """Per-camera detector that keeps its own counters but infers through an InferenceEngine."""
+
+    def __init__(self, engine):
+        vars(self).update(vars(engine.detector))  # Same settings and network, without reloading them
+        self.engine = engine
+        self.reset_state()
+
+    def detect(self, frame, inpSize=None):
+        # Pass this camera's own input size so cameras can run at different sizes
+        return self.engine.infer(frame, inpSize or (self.inpWidth, self.inpHeight))
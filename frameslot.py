@@ -0,0 +1,83 @@
+import threading
+import time
+from metrics import METRICS
+
+
+class LatestFrame:
+    """Single-slot hand-off of the newest frame from a capture thread to its consumer.
+
+    Every publish bumps a sequence number; consumers wait for a sequence newer
+    than the one they last processed, so a frame is never processed twice and
+    anything published in between counts as dropped. Frames are handed over
+    by reference: the producer must not touch an array after publishing it.
+    """
+
+    def __init__(self, name=None):
+        self.name = name  # Camera label for metrics; None keeps this slot out of them
+        self.cond = threading.Condition()
+        self.frame = None
+        self.seq = 0
+        self.timestamp = None
+        self.waiting = 0
+        self.frames_taken = 0
+        self.frames_dropped = 0
+        self.frames_skipped = 0  # Captured but never retrieved because nobody was waiting
+        self.total_age = 0.0
+        self.last_age = 0.0
+
+    def publish(self, frame):
+        with self.cond:
+            self.frame = frame
+            self.seq += 1
+            self.timestamp = time.monotonic()
+            self.cond.notify_all()
+
+    def peek(self):
+        """Return (seq, frame) of the newest frame without waiting or touching the statistics."""
+        with self.cond:
+            return self.seq, self.frame
+
+    def wanted(self):
+        """True while a consumer is blocked waiting, i.e. a frame decoded now would be used."""
+        return self.waiting > 0
+
+    def skip(self):
+        with self.cond:
+            self.frames_skipped += 1
+        if self.name is not None:
+            METRICS.inc('frames_dropped', self.name)
+
+    def wait_newer(self, seq, timeout=None):
+        """Block until a frame newer than seq arrives; return (seq, frame, timestamp), or None on timeout."""
+        with self.cond:
+            self.waiting += 1
+            try:
+                if not self.cond.wait_for(lambda: self.seq > seq, timeout):
+                    return None
+            finally:
+                self.waiting -= 1
+            dropped = self.seq - seq - 1 if seq > 0 else 0
+            self.frames_dropped += dropped
+            self.frames_taken += 1
+            self.last_age = time.monotonic() - self.timestamp
+            self.total_age += self.last_age
+            if self.name is not None:
+                METRICS.inc('frames_dropped', self.name, dropped)
+                METRICS.set('frame_age_seconds', self.name, self.last_age)
+            return self.seq, self.frame, self.timestamp
+
+    def stats(self):
+        with self.cond:
+            mean_age = self.total_age / self.frames_taken if self.frames_taken else 0.0
+            return {'published': self.seq, 'taken': self.frames_taken,
+                    'dropped': self.frames_dropped + self.frames_skipped,
+                    'last_age': self.last_age, 'mean_age': mean_age}
+
+    def report(self, name, motion_gate=None):
+        stats = self.stats()
+        line = (f"{name}: {stats['taken']} frames processed, {stats['dropped']} dropped, "
+                f"frame age {stats['last_age'] * 1000:.0f} ms (mean {stats['mean_age'] * 1000:.0f} ms)")
+        if motion_gate is not None:
+            line += (f", {motion_gate.inferences_skipped} of "
+                     f"{motion_gate.inferences_run + motion_gate.inferences_skipped} inferences skipped on no motion")
+        print(line)
@@ -1,42 +1,32 @@
+import argparse
 import cv2 as cv
 import threading
-import pandas as pd
+from config import get_camera_streams, update_csv_with_aoi
 from detector import YOLODetector  # Replace with your actual import statement
+from engine import InferenceEngine
+from frameslot import LatestFrame
+from metrics import METRICS
+from mjpeg import MJPEGCapture, decode_for_detector, retrieve_for_slot
 from rpi_relays import RaspberryRelayLogic  # Import the RaspberryRelayLogic class
+from zones import ZoneSet, draw_interest_area
 import time
-def get_camera_streams(csv_path):
-    """Read camera streams and pin numbers from a CSV file."""
-    camera_df = pd.read_csv(csv_path, header=None)
-    camera_streams = camera_df.iloc[:, 0].tolist()
-    camera_cords = [None] * len(camera_streams)  # Initialize with None for each camera
-    camera_pins = []
-
-    if camera_df.shape[1] > 1:
-        # Parse coordinates if the second column exists
-        for i in range(len(camera_streams)):
-            cords = camera_df.iloc[i, 1]
-            if pd.notna(cords):  # Check if cords is not NaN
-                camera_cords[i] = tuple(map(int, str(cords).split(',')))
-
-    if camera_df.shape[1] > 2:
-        # Parse pin numbers if the third column exists
-        camera_pins = [tuple(map(int, str(pins).split(','))) for pins in camera_df.iloc[:, 2]]
-
-    return camera_streams, camera_cords, camera_pins
 
 
 class CameraHandler:
-    def __init__(self, stream_url, window_name, relay_logic):
+    def __init__(self, stream_url, window_name, relay_logic, detector=None, capture_factory=cv.VideoCapture):
         self.stream_url = stream_url
         self.window_name = window_name
-        self.latest_frame = None
-        self.frame_lock = threading.Lock()
+        self.frames = LatestFrame(window_name)
+        self.preview_frame = None
         self.interest_area_defined = False
         self.interest_area = (0, 0, 0, 0)
-        self.yolo_detector = YOLODetector()
+        self.zones = None  # The interest area as a ZoneSet, what the detector tests boxes against
+        self.yolo_detector = detector if detector is not None else YOLODetector()
+        self.yolo_detector.camera = window_name
         self.ix, self.iy = -1, -1
         self.drawing = False
         self.relay_logic = relay_logic  # Add this line
+        self.capture_factory = capture_factory  # cv.VideoCapture or MJPEGIngest.capture
 
 
     def capture_video(self):
@@ -44,25 +34,38 @@ class CameraHandler:
         reconnect_delay = 10  # Delay in seconds
 
         while True:
-            cap = cv.VideoCapture(self.stream_url)
+            cap = self.capture_factory(self.stream_url)
             if not cap.isOpened():
                 print(f"Failed to open stream: {self.stream_url}")
                 return
 
             reconnect_attempts = 0
             while reconnect_attempts < max_reconnect_attempts:
-                ret, frame = cap.read()
-                if not ret:
+                start = METRICS.start()
+                if not cap.grab():
                     print(f"Stream lost, attempting to reconnect {self.stream_url}")
+                    if not isinstance(cap, MJPEGCapture):
+                        METRICS.inc('reconnects', self.window_name)  # MJPEGIngest counts its own reconnections
                     cap.release()
                     time.sleep(reconnect_delay)
-                    cap = cv.VideoCapture(self.stream_url)
+                    cap = self.capture_factory(self.stream_url)
                     reconnect_attempts += 1
                     continue
+                METRICS.stop(start, 'capture', self.window_name)
+                METRICS.inc('frames_captured', self.window_name)
+
+                reconnect_attempts = 0  # Reset reconnect attempts after a successful frame grab
 
-                with self.frame_lock:
-                    self.latest_frame = frame
-                reconnect_attempts = 0  # Reset reconnect attempts after a successful frame read
+                # A VideoCapture has decoded the frame in grab() already, but retrieve() still converts it to BGR.
+                # JPEG bytes from an MJPEGCapture cost nothing to publish, so every one of them is.
+                if getattr(cap, 'jpeg', None) is None and not self.frames.wanted():
+                    self.frames.skip()  # Nobody is waiting for this frame: skip the conversion
+                    continue
+                start = METRICS.start()
+                ret, frame = retrieve_for_slot(cap)
+                METRICS.stop(start, 'retrieve', self.window_name)
+                if ret:
+                    self.frames.publish(frame)  # Replaces any frame the processing thread hasn't picked up
 
             if reconnect_attempts >= max_reconnect_attempts:
                 print(f"Failed to reconnect after {max_reconnect_attempts} attempts: {self.stream_url}")
@@ -70,10 +73,11 @@ class CameraHandler:
 
             cap.release()
 
-    def draw_on_frame(self, frame):
-        if self.interest_area_defined:
-            x, y, w, h = self.interest_area
-            cv.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+    def set_interest_area(self, interest_area):
+        """Use an (x, y, w, h) interest area, as stored in the CSV."""
+        self.interest_area = interest_area
+        self.zones = ZoneSet.from_rect(interest_area)
+        self.interest_area_defined = True
 
     def draw_rectangle(self, event, x, y, flags, param):
         # status,cords=param
@@ -84,23 +88,21 @@ class CameraHandler:
             self.drawing = True
             self.ix, self.iy = x, y
         elif event == cv.EVENT_MOUSEMOVE and self.drawing:
-            temp_frame = self.latest_frame.copy()
+            temp_frame = self.preview_frame.copy()
             cv.rectangle(temp_frame, (self.ix, self.iy), (x, y), (0, 255, 0), 2)
             cv.imshow(self.window_name, temp_frame)
         elif event == cv.EVENT_LBUTTONUP:
             self.drawing = False
-            self.interest_area_defined = True
-            self.interest_area = (min(self.ix, x), min(self.iy, y), abs(self.ix - x), abs(self.iy - y))
+            self.set_interest_area((min(self.ix, x), min(self.iy, y), abs(self.ix - x), abs(self.iy - y)))
             # cv.destroyWindow(self.window_name)  # Close the preview window once the area is defined
 
     def define_interest_area(self, predefined_area):
         if predefined_area:
-            self.interest_area = predefined_area
-            self.interest_area_defined = True
+            self.set_interest_area(predefined_area)
             return
         # print(status)
         # Capture a single frame for preview
-        cap = cv.VideoCapture(self.stream_url)
+        cap = self.capture_factory(self.stream_url)
         ret, frame = cap.read()
         if not ret:
             print(f"Failed to grab a frame from stream: {self.stream_url}")
@@ -108,6 +110,7 @@ class CameraHandler:
             return
 
         cap.release()  # Release the capture immediately after grabbing the preview frame
+        self.preview_frame = frame
 
         # Display the preview frame
         cv.namedWindow(self.window_name)
@@ -127,16 +130,37 @@ class CameraHandler:
 
     def process_video(self):
         cv.namedWindow(self.window_name)  # Use the same window name for processing
+        seq = 0
+        report_interval = 60  # Seconds between frame statistics reports
+        last_report = time.monotonic()
         while True:
             key = cv.waitKey(1) & 0xFF
-            with self.frame_lock:
-                frame = self.latest_frame.copy() if self.latest_frame is not None else None
-            if frame is not None:
-                self.draw_on_frame(frame)
-                processed_frame, intersection, count = self.yolo_detector.process_frame(frame, self.interest_area)
-                # print(intersection, count)
-                cv.imshow(self.window_name, processed_frame)
-                self.relay_logic.update_relay_status(intersection, count)  # Add this line
+            # Only process frames that arrived since the last one; the short timeout keeps the window responsive
+            latest = self.frames.wait_newer(seq, timeout=0.05)
+            if latest is not None:
+                seq, item, _ = latest
+                # Compressed frames are decoded here, at the smallest scale the detector can use
+                start = METRICS.start()
+                frame, interest_area, _ = decode_for_detector(item, self.yolo_detector, self.zones)
+                METRICS.stop(start, 'decode', self.window_name)
+                if frame is not None:
+                    draw_interest_area(frame, interest_area)
+                    try:
+                        processed_frame, intersection, count = self.yolo_detector.process_frame(frame, interest_area)
+                    except Exception as e:
+                        print(f"Detection failed for {self.window_name}: {e}")  # Try again with the next frame
+                    else:
+                        # print(intersection, count)
+                        start = METRICS.start()
+                        cv.imshow(self.window_name, processed_frame)
+                        METRICS.stop(start, 'display', self.window_name)
+                        start = METRICS.start()
+                        self.relay_logic.update_relay_status(intersection, count)  # Add this line
+                        METRICS.stop(start, 'relay', self.window_name)
+
+            if time.monotonic() - last_report > report_interval:
+                self.frames.report(self.window_name, self.yolo_detector.motion_gate)
+                last_report = time.monotonic()
 
             if key == ord('q'):
                 break
@@ -146,13 +170,21 @@ class CameraHandler:
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Train detection with a window per camera")
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help="Serve Prometheus metrics on this local port (0 disables metrics)")
+    args = parser.parse_args()
+    if args.metrics_port:
+        METRICS.serve(args.metrics_port)
+
     cam_list_csv_path = 'cam_list.csv'
     camera_streams, camera_cords, camera_pins = get_camera_streams(cam_list_csv_path)
+    engine = InferenceEngine().start()  # One copy of the network shared by all cameras
 
     handlers = []
     for index, (stream_url, cords, pins) in enumerate(zip(camera_streams, camera_cords, camera_pins)):
-        relay_logic = RaspberryRelayLogic(*pins)  # Initialize relay logic for each camera
-        handler = CameraHandler(stream_url, f'Camera {index}', relay_logic)
+        relay_logic = RaspberryRelayLogic(*pins, name=f'Camera {index}')  # Initialize relay logic for each camera
+        handler = CameraHandler(stream_url, f'Camera {index}', relay_logic, engine.detector_for_camera())
         handlers.append(handler)
         threading.Thread(target=handler.capture_video, daemon=True).start()
 
@@ -163,27 +195,5 @@ def main():
         threading.Thread(target=handler.process_video).start()
 
 
-
-
-
-
-def update_csv_with_aoi(csv_path, stream_url, new_aoi):
-    camera_df = pd.read_csv(csv_path, header=None)
-    new_aoi_str = ",".join(map(str, new_aoi))  # Convert new_aoi to a comma-separated string
-
-    for index, row in camera_df.iterrows():
-        if row[0] == stream_url:
-            if camera_df.shape[1] < 2:  # Check if there is a column to store the new_aoi
-                # If not, append a new column
-                camera_df[1] = pd.NA
-            camera_df.at[index, 1] = new_aoi_str  # Store the new_aoi string
-            break
-
-    camera_df.to_csv(csv_path, header=None, index=False)
-    print('Saved to CSV')
-
-
-
-
 if __name__ == '__main__':
     main()
\ No newline at end of file
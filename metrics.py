@@ -0,0 +1,110 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """Per-camera stage timings, counters and gauges, rendered in Prometheus text format.
+
+    Disabled by default: start() then returns None and every other call
+    returns after a single attribute check, so the hooks can stay in the hot
+    path permanently.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.stages = {}  # (stage, camera) -> [bucket counts..., +Inf count, sum]
+        self.counters = {}  # (name, camera) -> value
+        self.gauges = {}  # (name, camera) -> value
+
+    def start(self):
+        return time.perf_counter() if self.enabled else None
+
+    def stop(self, start, stage, camera=''):
+        if start is None:
+            return
+        self.observe(stage, camera, time.perf_counter() - start)
+
+    def observe(self, stage, camera, seconds):
+        with self.lock:
+            histogram = self.stages.get((stage, camera))
+            if histogram is None:
+                histogram = self.stages[(stage, camera)] = [0] * (len(STAGE_BUCKETS) + 1) + [0.0]
+            histogram[bisect.bisect_left(STAGE_BUCKETS, seconds)] += 1
+            histogram[-1] += seconds
+
+    def inc(self, name, camera='', value=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[(name, camera)] = self.counters.get((name, camera), 0) + value
+
+    def set(self, name, camera, value):
+        if not self.enabled:
+            return
+        self.gauges[(name, camera)] = value
+
+    def render(self):
+        lines = ['# HELP train_stage_seconds Time spent in each pipeline stage',
+                 '# TYPE train_stage_seconds histogram']
+        with self.lock:
+            stages = {key: list(histogram) for key, histogram in self.stages.items()}
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+
+        for (stage, camera), histogram in sorted(stages.items()):
+            labels = f'stage="{escape_label(stage)}",camera="{escape_label(camera)}"'
+            cumulative = 0
+            for bound, count in zip(STAGE_BUCKETS + ('+Inf',), histogram[:-1]):
+                cumulative += count
+                lines.append(f'train_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'train_stage_seconds_sum{{{labels}}} {histogram[-1]}')
+            lines.append(f'train_stage_seconds_count{{{labels}}} {cumulative}')
+
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f'# TYPE train_{name}_total counter')
+            for (counter, camera), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append(f'train_{name}_total{{camera="{escape_label(camera)}"}} {value}')
+        for name in sorted({name for name, _ in gauges}):
+            lines.append(f'# TYPE train_{name} gauge')
+            for (gauge, camera), value in sorted(gauges.items()):
+                if gauge == name:
+                    lines.append(f'train_{name}{{camera="{escape_label(camera)}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port=9100, host='127.0.0.1'):
+        """Enable collection and export it on http://host:port/metrics from a daemon thread."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.enabled = True
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+        return server
+
+
+METRICS = Metrics()
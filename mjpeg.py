@@ -0,0 +1,247 @@
+import asyncio
+import ssl
+import threading
+from urllib.parse import urlsplit
+import cv2 as cv
+import numpy as np
+from frameslot import LatestFrame
+from metrics import METRICS
+from zones import ZoneSet
+
+MAX_PART_SIZE = 8 * 1024 * 1024  # Largest JPEG part we are willing to buffer
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+REDUCED_DECODE_FLAGS = {1: cv.IMREAD_COLOR, 2: cv.IMREAD_REDUCED_COLOR_2, 4: cv.IMREAD_REDUCED_COLOR_4,
+                        8: cv.IMREAD_REDUCED_COLOR_8}
+
+
+def parse_headers(block):
+    """Split an HTTP header block into its first line and a dict of lower-cased headers."""
+    lines = block.decode('latin-1').split('\r\n')
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(':')
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return lines[0], headers
+
+
+def multipart_boundary(content_type):
+    for param in content_type.split(';')[1:]:
+        name, _, value = param.strip().partition('=')
+        if name.lower() == 'boundary':
+            # Some cameras put the leading dashes in the header, some only in the body
+            return value.strip('"').lstrip('-').encode('latin-1')
+    raise ValueError(f"Not a multipart stream: {content_type!r}")
+
+
+def jpeg_size(jpeg):
+    """Read (width, height) from the JPEG frame header without decoding anything."""
+    i = 2
+    while i + 9 <= len(jpeg):
+        if jpeg[i] != 0xFF:
+            raise ValueError("Corrupt JPEG marker")
+        marker = jpeg[i + 1]
+        if marker == 0xFF:  # Fill byte
+            i += 1
+        elif marker in SOF_MARKERS:
+            return int.from_bytes(jpeg[i + 7:i + 9], 'big'), int.from_bytes(jpeg[i + 5:i + 7], 'big')
+        elif 0xD0 <= marker <= 0xD8 or marker == 0x01:  # Markers without a payload
+            i += 2
+        else:
+            i += 2 + int.from_bytes(jpeg[i + 2:i + 4], 'big')
+    raise ValueError("No frame header in JPEG")
+
+
+def decode_jpeg(jpeg, reduction=1):
+    """Decode a JPEG at 1/reduction of its size, letting libjpeg skip the detail instead of resizing afterwards."""
+    return cv.imdecode(np.frombuffer(jpeg, np.uint8), REDUCED_DECODE_FLAGS[reduction])
+
+
+def scale_area(interest_area, scale):
+    if not interest_area:
+        return interest_area
+    if isinstance(interest_area, ZoneSet):
+        return interest_area.scaled(scale)
+    return tuple(int(round(v * scale)) for v in interest_area)
+
+
+def decode_for_detector(item, detector, interest_area):
+    """Turn a frame slot item into an image for detector.
+
+    Compressed frames are decoded at the smallest scale that still fills the
+    network input. Returns (image, interest_area in its coordinates, scale of
+    the image relative to the stream), with image None for a JPEG that can't
+    be decoded.
+    """
+    if not isinstance(item, bytes):
+        return item, interest_area, 1.0
+    try:
+        width, height = jpeg_size(item)
+    except ValueError as e:
+        print(f"Skipping corrupt JPEG: {e}")
+        return None, interest_area, 1.0
+    frame = decode_jpeg(item, detector.decode_reduction(width, height, interest_area))
+    if frame is None:
+        return None, interest_area, 1.0
+    scale = frame.shape[1] / width
+    return frame, scale_area(interest_area, scale), scale
+
+
+def retrieve_for_slot(cap):
+    """Return the frame grabbed by cap, left compressed when the capture can hand out its JPEG."""
+    if isinstance(cap, MJPEGCapture):
+        return cap.jpeg is not None, cap.jpeg
+    return cap.retrieve()
+
+
+class MJPEGStream:
+    def __init__(self, url, name=None):
+        self.url = url
+        self.name = name if name is not None else url  # Label for metrics
+        self.frames = LatestFrame()  # Newest compressed JPEG, older ones are simply replaced
+        self.connected = False
+        self.frames_received = 0
+        self.reconnects = 0
+        self.future = None
+        self.task = None
+
+
+class MJPEGIngest:
+    """Reads many multipart MJPEG HTTP streams on a single asyncio event loop thread.
+
+    Only the newest JPEG of each stream is kept, still compressed. Lost
+    connections are retried with exponential backoff between min_backoff and
+    max_backoff seconds.
+    """
+
+    def __init__(self, connect_timeout=10, read_timeout=10, min_backoff=1, max_backoff=30):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.streams = {}
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.cancel_all(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    async def cancel_all(self):
+        await self.cancel({task for task in asyncio.all_tasks() if task is not asyncio.current_task()})
+
+    async def cancel(self, tasks):
+        while tasks:
+            # Repeated, because wait_for can swallow a cancellation that races with its read completing
+            for task in tasks:
+                task.cancel()
+            _, tasks = await asyncio.wait(tasks, timeout=0.1)
+
+    def add_stream(self, url, name=None):
+        if url not in self.streams:
+            stream = self.streams[url] = MJPEGStream(url, name)
+            stream.future = asyncio.run_coroutine_threadsafe(self.run_stream(stream), self.loop)
+        return self.streams[url]
+
+    def remove_stream(self, url):
+        """Stop reading url and close its connection; captures still holding it get no more frames."""
+        stream = self.streams.pop(url, None)
+        if stream is not None:
+            stream.frames.publish(None)  # Wakes captures waiting in grab(), which then fails
+            # Runs after run_stream has started, so stream.task is set: the loop runs callbacks in order
+            asyncio.run_coroutine_threadsafe(self.cancel({stream.task}), self.loop)
+
+    def capture(self, url):
+        """Drop-in replacement for cv.VideoCapture(url), usable as a CameraHandler capture_factory."""
+        return MJPEGCapture(self.add_stream(url), self.read_timeout)
+
+    async def run_stream(self, stream):
+        stream.task = asyncio.current_task()
+        backoff = self.min_backoff
+        while True:
+            try:
+                async for jpeg in self.read_parts(stream.url):
+                    stream.connected = True
+                    stream.frames_received += 1
+                    stream.frames.publish(jpeg)
+                    backoff = self.min_backoff
+                print(f"Stream ended, reconnecting in {backoff} s: {stream.url}")
+            except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+                print(f"Stream lost, reconnecting in {backoff} s {stream.url}: {e!r}")
+            stream.connected = False
+            stream.reconnects += 1
+            METRICS.inc('reconnects', stream.name)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    async def read_parts(self, url):
+        parts = urlsplit(url)
+        secure = parts.scheme == 'https'
+        port = parts.port or (443 if secure else 80)
+        path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        host = parts.hostname if parts.port is None else f'{parts.hostname}:{parts.port}'
+
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(parts.hostname, port, ssl=ssl.create_default_context() if secure else None,
+                                    limit=MAX_PART_SIZE),
+            self.connect_timeout)
+        try:
+            # HTTP/1.0, so the server can't answer with a chunked body, which this parser doesn't unwrap
+            writer.write(f'GET {path} HTTP/1.0\r\nHost: {host}\r\nConnection: close\r\n\r\n'.encode('latin-1'))
+            await writer.drain()
+            status, headers = parse_headers(await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.read_timeout))
+            if status.split()[1:2] != ['200']:
+                raise ValueError(f"Unexpected response: {status}")
+            delimiter = b'--' + multipart_boundary(headers.get('content-type', ''))
+
+            while True:
+                # Part headers, preceded by the delimiter line when the previous part had a Content-Length
+                _, part_headers = parse_headers(await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.read_timeout))
+                length = part_headers.get('content-length')
+                if length:
+                    body = await asyncio.wait_for(reader.readexactly(int(length)), self.read_timeout)
+                else:
+                    body = await asyncio.wait_for(reader.readuntil(delimiter), self.read_timeout)
+                    body = body[:-len(delimiter)].rstrip(b'-\r\n')
+                if body.startswith(b'\xff\xd8'):
+                    yield body
+        finally:
+            writer.close()
+
+
+class MJPEGCapture:
+    """cv.VideoCapture look-alike that decodes the newest JPEG of an MJPEGIngest stream."""
+
+    def __init__(self, stream, timeout=10):
+        self.stream = stream
+        self.timeout = timeout
+        self.seq = 0
+        self.jpeg = None
+
+    def isOpened(self):
+        return True
+
+    def grab(self):
+        latest = self.stream.frames.wait_newer(self.seq, self.timeout)
+        if latest is None:
+            self.jpeg = None
+            return False
+        self.seq, self.jpeg, _ = latest
+        return self.jpeg is not None
+
+    def retrieve(self):
+        frame = decode_jpeg(self.jpeg) if self.jpeg is not None else None
+        return frame is not None, frame
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def release(self):
+        pass  # The ingest keeps the connection; it is shared with other readers of the stream
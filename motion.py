@@ -0,0 +1,45 @@
+import cv2 as cv
+import numpy as np
+
+
+class MotionGate:
+    """Decides whether a frame is worth a network pass.
+
+    Keeps a small grayscale running background of the interest area and
+    scores each frame by the fraction of pixels that moved away from it.
+    Frames scoring below threshold are skipped, but never more than
+    refresh_interval in a row.
+    """
+
+    def __init__(self, threshold=0.02, refresh_interval=25, size=64, alpha=0.05, pixel_threshold=25):
+        self.threshold = threshold
+        self.refresh_interval = refresh_interval
+        self.size = size
+        self.alpha = alpha  # Background learning rate
+        self.pixel_threshold = pixel_threshold  # Gray level difference that counts as a changed pixel
+        self.background = None
+        self.frames_since_inference = 0
+        self.last_score = 1.0
+        self.inferences_run = 0
+        self.inferences_skipped = 0
+
+    def change_score(self, region):
+        small = cv.resize(region, (self.size, self.size), interpolation=cv.INTER_AREA)
+        gray = cv.cvtColor(small, cv.COLOR_BGR2GRAY).astype(np.float32)
+        if self.background is None:
+            self.background = gray
+            return 1.0
+        diff = cv.absdiff(gray, self.background)
+        cv.accumulateWeighted(gray, self.background, self.alpha)
+        return np.count_nonzero(diff > self.pixel_threshold) / diff.size
+
+    def should_infer(self, region, force=False):
+        """force passes the frame whatever its score, e.g. with no detections to reuse; the background still learns."""
+        self.last_score = self.change_score(region)
+        if force or self.last_score >= self.threshold or self.frames_since_inference >= self.refresh_interval:
+            self.frames_since_inference = 0
+            self.inferences_run += 1
+            return True
+        self.frames_since_inference += 1
+        self.inferences_skipped += 1
+        return False
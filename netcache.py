@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import shutil
+import cv2 as cv
+import numpy as np
+
+
+def file_digest(path, chunk=1 << 16):
+    """Short content hash of a file: its size plus the first and last chunk, so large clips hash instantly."""
+    digest = hashlib.sha1()
+    size = os.path.getsize(path)
+    digest.update(str(size).encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(chunk))
+        if size > chunk:
+            f.seek(max(size - chunk, chunk))
+            digest.update(f.read(chunk))
+    return digest.hexdigest()[:16]
+
+
+def model_digest(modelConf, modelWeights):
+    digest = hashlib.sha1()
+    for path in (modelConf, modelWeights):
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def cache_path(cache_dir, clip_path, model, inpSize):
+    return os.path.join(cache_dir, file_digest(clip_path), f'{model}_{inpSize[0]}x{inpSize[1]}')
+
+
+def build_cache(detector, clip_path, path, floor=0.05, batch_size=8, max_frames=None):
+    """Run the network over every frame of clip_path and store its raw output rows under path.
+
+    Only rows whose best class score exceeds floor are kept, which drops
+    nearly all of them; decoding the cache then gives exactly the network's
+    detections for any confThreshold >= floor.
+    """
+    outputNames = detector.getOutputsNames()
+    inpSize = (detector.inpWidth, detector.inpHeight)
+    cap = cv.VideoCapture(clip_path)
+    rows, counts, sizes = [], [], []
+
+    def forward(frames):
+        blob = cv.dnn.blobFromImages(frames, 1 / 255, inpSize, [0, 0, 0], 1, crop=False)
+        detector.net.setInput(blob)
+        outs = detector.net.forward(outputNames)
+        outputs = np.concatenate([out.reshape(len(frames), -1, out.shape[-1]) for out in outs], axis=1)
+        for frame, output in zip(frames, outputs):
+            kept = output[output[:, 5:].max(axis=1) > floor]
+            rows.append(kept)
+            counts.append(len(kept))
+            sizes.append((frame.shape[1], frame.shape[0]))
+
+    batch = []
+    while max_frames is None or len(counts) + len(batch) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        batch.append(frame)
+        if len(batch) == batch_size:
+            forward(batch)
+            batch = []
+    if batch:
+        forward(batch)
+    cap.release()
+    if not counts:
+        raise ValueError(f"No frames could be read from {clip_path}")
+
+    # Written to a temporary directory first so an interrupted run never leaves a partial cache
+    tmp = path + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    np.save(os.path.join(tmp, 'rows.npy'), np.concatenate(rows).astype(np.float32))
+    np.save(os.path.join(tmp, 'offsets.npy'), np.concatenate([[0], np.cumsum(counts)]).astype(np.int64))
+    np.save(os.path.join(tmp, 'sizes.npy'), np.asarray(sizes, dtype=np.int32))
+    with open(os.path.join(tmp, 'meta.json'), 'wt') as f:
+        json.dump({'clip': os.path.abspath(clip_path), 'frames': len(counts), 'floor': floor,
+                   'inpSize': list(inpSize)}, f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp, path)
+
+
+class OutputCache:
+    """Raw network output of a cached clip, memory-mapped, indexed by frame number."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'rt') as f:
+            self.meta = json.load(f)
+        self.floor = self.meta['floor']
+        self.rows = np.load(os.path.join(path, 'rows.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'))
+        self.sizes = np.load(os.path.join(path, 'sizes.npy'))
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def frame(self, index):
+        """Return (outs, (width, height)) of a frame, outs in the list form detector.decode expects."""
+        rows = np.asarray(self.rows[self.offsets[index]:self.offsets[index + 1]])
+        return [rows], tuple(int(v) for v in self.sizes[index])
+
+
+def open_cache(detector, clip_path, cache_dir='netcache', modelConf='train.cfg', modelWeights='train_last.weights',
+               floor=0.05, max_frames=None):
+    """Return the OutputCache of clip_path for the detector's model and input size, building it if missing."""
+    inpSize = (detector.inpWidth, detector.inpHeight)
+    path = cache_path(cache_dir, clip_path, model_digest(modelConf, modelWeights), inpSize)
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        cache = OutputCache(path)
+        if cache.floor <= floor and (max_frames is None or len(cache) >= max_frames):
+            return cache
+    print(f"Caching network output of {clip_path} at {inpSize[0]}x{inpSize[1]}")
+    build_cache(detector, clip_path, path, floor, max_frames=max_frames)
+    return OutputCache(path)
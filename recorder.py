@@ -0,0 +1,165 @@
+import collections
+import json
+import os
+import queue
+import threading
+import time
+import cv2 as cv
+from metrics import METRICS
+
+
+class ClipWriter:
+    """Writes event clips to disk on its own thread, shared by all cameras.
+
+    Clips are stored as concatenated JPEGs (.mjpeg, playable with ffplay or
+    cv.VideoCapture) plus a .json with the frame timestamps. When the disk
+    falls behind, frames are dropped rather than blocking the caller. Opens
+    and closes are never dropped and never block: they are a few bytes each
+    and only the frames count against max_queue.
+    """
+
+    def __init__(self, directory='clips', max_queue=2000):
+        self.directory = directory
+        self.queue = queue.Queue()  # Unbounded, so callers holding a recorder lock never wait on the disk
+        self.max_queue = max_queue  # Most frames waiting to be written
+        self.queued_frames = 0
+        self.lock = threading.Lock()
+        self.open_clips = {}  # clip path -> (file, frame timestamps, clip info)
+        self.frames_dropped = 0
+        self.clips_written = 0
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        threading.Thread(target=self.run, daemon=True).start()
+        return self
+
+    def submit(self, op, path, payload=None):
+        if op == 'frames':
+            with self.lock:
+                if self.queued_frames + len(payload) > self.max_queue:
+                    self.frames_dropped += len(payload)
+                    return
+                self.queued_frames += len(payload)
+        self.queue.put((op, path, payload))
+
+    def run(self):
+        while True:
+            op, path, payload = self.queue.get()
+            try:
+                if op == 'open':
+                    self.open_clips[path] = (open(path + '.mjpeg', 'wb'), [], payload)
+                elif op == 'frames':
+                    with self.lock:
+                        self.queued_frames -= len(payload)
+                    clip, timestamps, _ = self.open_clips[path]
+                    for timestamp, jpeg in payload:
+                        clip.write(jpeg)
+                        timestamps.append(timestamp)
+                elif op == 'close':
+                    clip, timestamps, info = self.open_clips.pop(path)
+                    clip.close()
+                    info['timestamps'] = timestamps
+                    with open(path + '.json', 'wt') as f:
+                        json.dump(info, f)
+                    self.clips_written += 1
+                    METRICS.inc('clips_written', info['camera'])
+            except (OSError, KeyError) as e:
+                print(f"Clip write failed for {path}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def join(self):
+        self.queue.join()
+
+
+class ClipRecorder:
+    """Per-camera pre-roll buffer of JPEG frames that turns intersection events into clips.
+
+    add() keeps the last pre_roll seconds of frames within max_bytes; camera
+    JPEGs are stored as they are, decoded frames are encoded once. When
+    update() sees the intersection start, the buffer is handed to the writer
+    and frames keep streaming into the clip until post_roll seconds after the
+    intersection ends, or max_length seconds after the start.
+    """
+
+    def __init__(self, writer, camera, pre_roll=5.0, post_roll=5.0, max_bytes=8 * 1024 * 1024,
+                 max_length=120.0, jpeg_quality=80):
+        self.writer = writer
+        self.camera = camera
+        self.pre_roll = pre_roll
+        self.post_roll = post_roll
+        self.max_bytes = max_bytes
+        self.max_length = max_length
+        self.jpeg_quality = jpeg_quality
+        self.lock = threading.Lock()
+        self.buffer = collections.deque()  # (timestamp, jpeg)
+        self.buffered_bytes = 0
+        self.intersection = False
+        self.clip = None  # Path of the clip being recorded
+        self.clip_started = None
+        self.clip_until = None
+        self.pending = []  # Frames for the open clip not yet handed to the writer
+
+    def add(self, frame, timestamp=None):
+        """Buffer a frame from the capture thread; frame is JPEG bytes or a BGR array."""
+        if timestamp is None:
+            timestamp = time.time()
+        if not isinstance(frame, (bytes, bytearray, memoryview)):
+            ret, encoded = cv.imencode('.jpg', frame, [cv.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+            if not ret:
+                return
+            frame = encoded.tobytes()
+        with self.lock:
+            self.buffer.append((timestamp, frame))
+            self.buffered_bytes += len(frame)
+            while self.buffer and (self.buffered_bytes > self.max_bytes
+                                   or timestamp - self.buffer[0][0] > self.pre_roll):
+                self.buffered_bytes -= len(self.buffer.popleft()[1])
+            if self.clip is None:
+                return
+            self.pending.append((timestamp, frame))
+            if timestamp > self.clip_until or timestamp - self.clip_started > self.max_length:
+                self.finish()
+            elif len(self.pending) >= 10:
+                self.flush()
+
+    def update(self, intersection, timestamp=None):
+        """Feed the intersection state of each processed frame, from the processing thread."""
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            if intersection and not self.intersection and self.clip is None:
+                self.start_clip(timestamp)
+            if self.clip is not None and (intersection or self.intersection):
+                # Extend while the train is in the AOI, and post_roll past the moment it leaves
+                self.clip_until = timestamp + self.post_roll
+            elif self.clip is not None and timestamp > self.clip_until:
+                self.finish()  # The camera may have stopped delivering frames
+            self.intersection = intersection
+
+    def start_clip(self, timestamp):
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(timestamp))
+        name = f"{self.camera}_{stamp}-{int(timestamp * 1000) % 1000:03d}".replace(' ', '_')
+        self.clip = os.path.join(self.writer.directory, name)
+        self.clip_started = timestamp
+        self.clip_until = timestamp + self.post_roll
+        self.writer.submit('open', self.clip, {'camera': self.camera, 'event': timestamp})
+        self.pending = list(self.buffer)  # The pre-roll; the JPEG bytes are shared, not copied
+        self.flush()
+        METRICS.inc('clips_started', self.camera)
+
+    def flush(self):
+        if self.pending:
+            self.writer.submit('frames', self.clip, self.pending)
+            self.pending = []
+
+    def finish(self):
+        self.flush()
+        self.writer.submit('close', self.clip)
+        self.clip = None
+
+    def close(self):
+        """Finish the clip being recorded, if any, e.g. when the camera is removed."""
+        with self.lock:
+            if self.clip is not None:
+                self.finish()
@@ -0,0 +1,214 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+import numpy as np
+from detlog import RECORD
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov', '.mjpeg', '.mjpg', '.h264', '.ts')
+
+detector = None  # Per worker process, set by init_worker
+settings = None
+
+
+def find_videos(paths, out_dir):
+    """(video path, output path without extension) for every video in paths, which are files or directories."""
+    videos = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.lower().endswith(VIDEO_EXTENSIONS):
+                        video = os.path.join(root, name)
+                        videos.append((video, os.path.join(out_dir, os.path.relpath(video, path))))
+        else:
+            videos.append((path, os.path.join(out_dir, os.path.basename(path))))
+    return videos
+
+
+def is_done(video, output):
+    """True if output holds finished results for this exact version of the video."""
+    try:
+        with open(output + '.json', 'rt') as f:
+            summary = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return summary.get('size') == os.path.getsize(video) and summary.get('mtime') == os.path.getmtime(video)
+
+
+def init_worker(detector_args, num_threads, worker_settings):
+    global detector, settings
+    import cv2 as cv
+    cv.setNumThreads(num_threads)
+    from detector import YOLODetector
+    from zones import ZoneSet
+    detector = YOLODetector(drawDetections=False, **detector_args)
+    settings = dict(worker_settings)
+    if settings['interest_area']:
+        settings['zones'] = ZoneSet.from_rect(settings['interest_area'])  # x,y,w,h, as in the camera CSV
+
+
+def read_batches(path, batch_size, batches):
+    """Decode thread: put (frames, timestamps) batches on the queue, then None."""
+    import cv2 as cv
+    cap = cv.VideoCapture(path)
+    try:
+        frames, timestamps = [], []
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+            timestamps.append(cap.get(cv.CAP_PROP_POS_MSEC) / 1000)
+            if len(frames) == batch_size:
+                batches.put((frames, timestamps))
+                frames, timestamps = [], []
+        if frames:
+            batches.put((frames, timestamps))
+    finally:
+        cap.release()
+        batches.put(None)
+
+
+def detect_batch(frames, interest_area):
+    if not (detector.aoiCrop and interest_area):
+        return detector.detect_batch(frames)
+    height, width = frames[0].shape[:2]
+    left, top, right, bottom = detector.crop_region(width, height, interest_area)
+    if right <= left or bottom <= top:
+        return detector.detect_batch(frames)
+    # The AOI is fixed, so every crop has the same size and the whole batch shares one input size
+    crops = [frame[top:bottom, left:right] for frame in frames]
+    detections = detector.detect_batch(crops, detector.crop_input_size(right - left, bottom - top))
+    for _, _, boxes in detections:
+        boxes[:, 0] += left
+        boxes[:, 1] += top
+    return detections
+
+
+def timeline(intersections, timestamps):
+    """Intervals of consecutive intersection frames as dicts of start/end frame and time."""
+    intervals = []
+    changes = np.flatnonzero(np.diff(np.concatenate([[False], intersections, [False]]).astype(np.int8)))
+    for start, end in zip(changes[::2], changes[1::2]):
+        intervals.append({'start_frame': int(start), 'end_frame': int(end - 1),
+                          'start': float(timestamps[start]), 'end': float(timestamps[end - 1])})
+    return intervals
+
+
+def process_video(task):
+    """Pool entry point: never raises, so one bad video doesn't stop the run."""
+    try:
+        return run_video(*task) + (None,)
+    except Exception as e:
+        return task[0], 0, 0.0, f"{type(e).__name__}: {e}"
+
+
+def run_video(video, output):
+    """Run one video through decode -> batched inference -> postprocess and write its results."""
+    interest_area = settings.get('zones')
+    detector.reset_state()
+    batches = queue.Queue(settings['prefetch'])
+    threading.Thread(target=read_batches, args=(video, settings['batch_size'], batches), daemon=True).start()
+
+    started = time.perf_counter()
+    chunks, intersections, timestamps = [], [], []
+    frame_index = 0
+    while True:
+        batch = batches.get()
+        if batch is None:
+            break
+        frames, batch_timestamps = batch
+        for frame, timestamp, detections in zip(frames, batch_timestamps, detect_batch(frames, interest_area)):
+            intersection, box_hits = False, False
+            if interest_area:
+                _, intersection = detector.apply_detections(frame, detections, interest_area)
+                box_hits = detector.box_hits
+            classIDs, confidences, boxes = detections
+            records = np.zeros(len(classIDs), dtype=RECORD)
+            records['timestamp'] = timestamp
+            records['camera'] = settings['camera']
+            records['class_id'] = classIDs
+            records['confidence'] = confidences
+            records['left'], records['top'], records['width'], records['height'] = boxes.reshape(-1, 4).T
+            records['intersection'] = box_hits
+            chunks.append(records)
+            intersections.append(intersection)
+            timestamps.append(timestamp)
+            frame_index += 1
+    elapsed = time.perf_counter() - started
+    if frame_index == 0:
+        raise ValueError("No frames could be read")
+
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    records = np.concatenate(chunks) if chunks else np.zeros(0, dtype=RECORD)
+    records.tofile(output + '.det.tmp')
+    os.replace(output + '.det.tmp', output + '.det')
+    summary = {'video': os.path.abspath(video), 'size': os.path.getsize(video), 'mtime': os.path.getmtime(video),
+               'frames': frame_index, 'detections': len(records), 'seconds': elapsed,
+               'fps': frame_index / elapsed if elapsed else 0.0, 'interest_area': settings['interest_area'],
+               'intersections': timeline(np.array(intersections, dtype=bool), timestamps)}
+    # The summary is written last and marks the video as done for --resume
+    with open(output + '.json.tmp', 'wt') as f:
+        json.dump(summary, f, indent=2)
+    os.replace(output + '.json.tmp', output + '.json')
+    return video, frame_index, elapsed
+
+
+def parse_aoi(text):
+    return tuple(int(v) for v in text.split(','))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run detection over recorded video files")
+    parser.add_argument('paths', nargs='+', help="Video files or directories searched recursively")
+    parser.add_argument('--out', default='reprocessed', help="Directory for the per-video .det and .json results")
+    parser.add_argument('--cfg', default='train.cfg')
+    parser.add_argument('--weights', default='train_last.weights')
+    parser.add_argument('--names', default='obj.names')
+    parser.add_argument('--size', type=int, default=416, help="Network input size")
+    parser.add_argument('--aoi', type=parse_aoi, default=None, help="Interest area x,y,w,h for the intersection timeline")
+    parser.add_argument('--aoi-crop', action='store_true', help="Run the network on the interest area only")
+    parser.add_argument('--camera', type=int, default=0, help="Camera number stored in the records")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Worker processes, one video each")
+    parser.add_argument('--threads-per-worker', type=int, default=1)
+    parser.add_argument('--batch', type=int, default=8, help="Frames per forward pass")
+    parser.add_argument('--prefetch', type=int, default=4, help="Decoded batches buffered ahead of inference")
+    parser.add_argument('--resume', action='store_true', help="Skip videos whose results are already complete")
+    args = parser.parse_args()
+
+    videos = find_videos(args.paths, args.out)
+    if args.resume:
+        pending = [(video, output) for video, output in videos if not is_done(video, output)]
+        print(f"Skipping {len(videos) - len(pending)} videos with complete results")
+        videos = pending
+    if not videos:
+        print("Nothing to do")
+        return
+
+    detector_args = dict(modelConf=args.cfg, modelWeights=args.weights, classesFile=args.names,
+                         inpWidth=args.size, inpHeight=args.size, aoiCrop=args.aoi_crop)
+    worker_settings = dict(interest_area=args.aoi, camera=args.camera, batch_size=args.batch, prefetch=args.prefetch)
+    workers = min(args.workers, len(videos))
+    cores = workers * args.threads_per_worker
+    started = time.perf_counter()
+    total_frames = 0
+    ctx = mp.get_context('spawn')
+    with ctx.Pool(workers, init_worker, (detector_args, args.threads_per_worker, worker_settings)) as pool:
+        for index, (video, frames, elapsed, error) in enumerate(pool.imap_unordered(process_video, videos), 1):
+            if error:
+                print(f"[{index}/{len(videos)}] {video}: failed, {error}")
+                continue
+            total_frames += frames
+            print(f"[{index}/{len(videos)}] {video}: {frames} frames, {frames / elapsed if elapsed else 0:.1f} fps")
+    elapsed = time.perf_counter() - started
+    fps = total_frames / elapsed
+    print(f"{total_frames} frames in {elapsed:.1f} s: {fps:.1f} fps, {fps / cores:.1f} fps per core "
+          f"({workers} workers x {args.threads_per_worker} threads)")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,33 +1,162 @@
-# import RPi.GPIO as GPIO
+import queue
+import threading
+import time
+from metrics import METRICS
+
+RED, YELLOW, GREEN = 'red', 'yellow', 'green'
+
+
+class MockGPIO:
+    """Stand-in for the RPi.GPIO module that records pin levels, for running off the Pi."""
+    BCM = 'BCM'
+    OUT = 'OUT'
+    LOW = 0
+    HIGH = 1
+
+    def __init__(self, delay=0.0):
+        self.delay = delay  # Simulated time per write, e.g. for a slow remote relay board
+        self.mode = None
+        self.pins = {}
+        self.writes = 0
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, pin, direction):
+        self.pins[pin] = self.LOW
+
+    def output(self, pin, level):
+        if self.delay:
+            time.sleep(self.delay)
+        self.pins[pin] = level
+        self.writes += 1
+
+
+def default_gpio():
+    try:
+        import RPi.GPIO as GPIO
+    except ImportError:
+        print("WARNING: RPi.GPIO is not installed, relays are simulated and no signal lamp will switch")
+        return MockGPIO()
+    return GPIO
+
+
+class RelayActuator:
+    """Performs relay writes on its own thread so slow GPIO never holds up inference.
+
+    Only the newest requested state of each relay is written, so a backlog
+    collapses instead of replaying stale states.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.pending = {}  # relay -> (state, requested at)
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def request(self, relay, state):
+        with self.lock:
+            queued = relay in self.pending
+            self.pending[relay] = (state, time.monotonic())
+        if not queued:
+            self.queue.put(relay)
+
+    def run(self):
+        while True:
+            relay = self.queue.get()
+            with self.lock:
+                state, requested = self.pending.pop(relay)
+            try:
+                relay.write(state)
+                relay.actuation_latency = time.monotonic() - requested
+                if METRICS.enabled:
+                    METRICS.observe('actuation', relay.name, relay.actuation_latency)
+            except Exception as e:
+                print(f"Relay write failed for {relay.name}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def join(self):
+        """Block until every requested write has been performed."""
+        self.queue.join()
+
+
+_default_actuator = None
+_default_actuator_lock = threading.Lock()
+
+
+def default_actuator():
+    global _default_actuator
+    with _default_actuator_lock:
+        if _default_actuator is None:
+            _default_actuator = RelayActuator().start()
+        return _default_actuator
+
 
 class RaspberryRelayLogic:
-    def __init__(self, red_pin, yellow_pin, green_pin):
+    """Red/yellow/green signal for one camera, driven by the detector's intersection state.
+
+    update_relay_status only works out the wanted state and is cheap to call
+    every frame. A state must be asked for debounce updates in a row before
+    the relay switches, except red which switches at once so a train is
+    never signalled late. Hardware is touched only on actual transitions,
+    through the actuator thread.
+    """
+
+    def __init__(self, red_pin, yellow_pin, green_pin, gpio=None, actuator=None, debounce=3, name=None):
         self.red_pin = red_pin
         self.yellow_pin = yellow_pin
         self.green_pin = green_pin
-        # GPIO.setmode(GPIO.BCM)
-        # GPIO.setup(self.red_pin, GPIO.OUT)
-        # GPIO.setup(self.yellow_pin, GPIO.OUT)
-        # GPIO.setup(self.green_pin, GPIO.OUT)
+        self.gpio = gpio if gpio is not None else default_gpio()
+        self.actuator = actuator if actuator is not None else default_actuator()
+        self.debounce = debounce
+        self.name = name if name is not None else f'pins {red_pin},{yellow_pin},{green_pin}'
+        self.state = None  # Last state sent to the actuator
+        self.candidate = None
+        self.candidate_count = 0
+        self.transitions = 0
+        self.actuation_latency = None
+        self.gpio.setmode(self.gpio.BCM)
+        for pin in (self.red_pin, self.yellow_pin, self.green_pin):
+            self.gpio.setup(pin, self.gpio.OUT)
+
+    def wanted_state(self, intersection, count):
+        if intersection:
+            # Red while a train has been detected for less than 100 frames, yellow after that
+            return RED if count < 100 else YELLOW
+        if count == 0:
+            # Green once no train is detected and the count has been reset
+            return GREEN
+        return None  # Train just left, the detector is still counting down: keep the current state
 
     def update_relay_status(self, intersection, count):
-        # Turn off all lights initially
-        # GPIO.output(self.red_pin, GPIO.LOW)
-        # GPIO.output(self.yellow_pin, GPIO.LOW)
-        # GPIO.output(self.green_pin, GPIO.LOW)
+        state = self.wanted_state(intersection, count)
+        if state is None or state == self.state:
+            self.candidate, self.candidate_count = None, 0
+            return
+        if state == self.candidate:
+            self.candidate_count += 1
+        else:
+            self.candidate, self.candidate_count = state, 1
+        if state == RED or self.candidate_count >= self.debounce:
+            self.state = state
+            self.candidate, self.candidate_count = None, 0
+            self.transitions += 1
+            METRICS.inc('relay_transitions', self.name)
+            self.actuator.request(self, state)
 
-        if intersection:
-            if count < 100:
-                # Turn on red light if a train is detected for less than 100 frames
-                # print(self.red_pin)
-                pass
-            else:
-                # print(self.yellow_pin)
-
-                # Turn on yellow light if a train is detected for more than 100 frames
-                pass
-        elif count == 0:
-            # print(self.green_pin)
-
-            # Turn on green light if no train is detected and count is reset to 0
-            pass
+    def switch_off(self):
+        """Turn all three lights off, e.g. before the pins are reassigned."""
+        self.state = None
+        self.candidate, self.candidate_count = None, 0
+        self.actuator.request(self, None)
+
+    def write(self, state):
+        """Set the pins for state; called on the actuator thread."""
+        for pin, pin_state in ((self.red_pin, RED), (self.yellow_pin, YELLOW), (self.green_pin, GREEN)):
+            self.gpio.output(pin, self.gpio.HIGH if state == pin_state else self.gpio.LOW)
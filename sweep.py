@@ -0,0 +1,118 @@
+import argparse
+import itertools
+import json
+import time
+import numpy as np
+from detector import YOLODetector
+from netcache import open_cache
+from rpi_relays import MockGPIO, RaspberryRelayLogic
+from zones import ZoneSet
+
+
+class NullActuator:
+    """Relay writes don't matter in a replay; the relay state is read from the relay logic itself."""
+
+    def request(self, relay, state):
+        pass
+
+
+def replay_detections(detector, cache, frames, confThreshold, nmsThreshold):
+    """Decode and NMS the first frames cached frames with the given thresholds."""
+    detector.confThreshold, detector.nmsThreshold = confThreshold, nmsThreshold
+    detections = []
+    for index in range(frames):
+        outs, (width, height) = cache.frame(index)
+        detections.append(detector.nms(*detector.decode(outs, width, height)))
+    return detections
+
+
+def replay_decisions(detector, detections, interest_area, debounce):
+    """Intersection flag and relay state per frame, as process_frame and the relay logic would produce them."""
+    detector.reset_state()
+    relay = RaspberryRelayLogic(0, 1, 2, gpio=MockGPIO(), actuator=NullActuator(), debounce=debounce)
+    intersections, states = [], []
+    for frame_detections in detections:
+        _, intersection = detector.apply_detections(None, frame_detections, interest_area)
+        relay.update_relay_status(intersection, detector.intersection_count)
+        intersections.append(intersection)
+        states.append(relay.state)
+    return np.array(intersections), np.array(states, dtype=object), relay.transitions
+
+
+def summarize(intersections, states, transitions, baseline=None):
+    summary = {'intersection_frames': int(intersections.sum()),
+               'events': int(np.count_nonzero(intersections[1:] & ~intersections[:-1]) + intersections[:1].sum()),
+               'relay_transitions': transitions, 'red_frames': int(np.count_nonzero(states == 'red'))}
+    if baseline is not None:
+        summary['changed_intersections'] = int(np.count_nonzero(intersections != baseline[0]))
+        summary['changed_relay'] = int(np.count_nonzero(states != baseline[1]))
+    return summary
+
+
+def parse_floats(text):
+    return [float(v) for v in text.split(',')]
+
+
+def parse_aoi(text):
+    """An x,y,w,h interest area."""
+    return tuple(int(v) for v in text.split(','))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Re-evaluate thresholds and AOIs on a recorded clip from cached network output")
+    parser.add_argument('video', help="Recorded clip")
+    parser.add_argument('--cfg', default='train.cfg')
+    parser.add_argument('--weights', default='train_last.weights')
+    parser.add_argument('--names', default='obj.names')
+    parser.add_argument('--size', type=int, default=416, help="Network input size")
+    parser.add_argument('--cache-dir', default='netcache')
+    parser.add_argument('--floor', type=float, default=0.05,
+                        help="Lowest confidence kept in the cache; sweeps are exact for thresholds above it")
+    parser.add_argument('--max-frames', type=int, default=None)
+    parser.add_argument('--conf', type=parse_floats, default=[0.3, 0.4, 0.5, 0.6, 0.7], help="confThreshold values")
+    parser.add_argument('--nms', type=parse_floats, default=[0.1, 0.3, 0.5], help="nmsThreshold values")
+    parser.add_argument('--aoi', type=parse_aoi, action='append', default=None,
+                        help="Interest area x,y,w,h; repeat to compare several")
+    parser.add_argument('--relay-debounce', type=int, default=3)
+    parser.add_argument('--out', default='sweep_results.json')
+    args = parser.parse_args()
+
+    aois = args.aoi or [(199, 194, 178, 145)]
+    zone_sets = [ZoneSet.from_rect(aoi) for aoi in aois]  # Tested the way test_multi.py tests CSV areas
+    detector = YOLODetector(args.cfg, args.weights, args.names, inpWidth=args.size, inpHeight=args.size,
+                            drawDetections=False)
+    baseline_params = (detector.confThreshold, detector.nmsThreshold)
+    if min(args.conf + [baseline_params[0]]) < args.floor:
+        print(f"Warning: confidence thresholds below --floor {args.floor} are not exact")
+    cache = open_cache(detector, args.video, args.cache_dir, args.cfg, args.weights, args.floor, args.max_frames)
+    frames = len(cache) if args.max_frames is None else min(len(cache), args.max_frames)
+
+    start = time.perf_counter()
+    baseline = replay_decisions(detector, replay_detections(detector, cache, frames, *baseline_params),
+                                zone_sets[0], args.relay_debounce)
+    results = []
+    for conf, nms in itertools.product(args.conf, args.nms):
+        detections = replay_detections(detector, cache, frames, conf, nms)
+        for aoi, zones in zip(aois, zone_sets):
+            summary = summarize(*replay_decisions(detector, detections, zones, args.relay_debounce), baseline[:2])
+            results.append(dict(conf=conf, nms=nms, aoi=list(aoi), **summary))
+    elapsed = time.perf_counter() - start
+
+    print(f"Baseline conf {baseline_params[0]} nms {baseline_params[1]} aoi {aois[0]}: {summarize(*baseline)}")
+    print(f"{'conf':>5} {'nms':>5} {'aoi':>20} {'inter':>6} {'events':>6} {'relay':>5} "
+          f"{'red':>6} {'d_inter':>7} {'d_relay':>7}")
+    for r in results:
+        print(f"{r['conf']:>5} {r['nms']:>5} {','.join(map(str, r['aoi'])):>20} {r['intersection_frames']:>6} "
+              f"{r['events']:>6} {r['relay_transitions']:>5} {r['red_frames']:>6} "
+              f"{r['changed_intersections']:>7} {r['changed_relay']:>7}")
+    print(f"{len(results)} combinations over {frames} frames in {elapsed:.2f} s")
+
+    with open(args.out, 'wt') as f:
+        json.dump({'video': args.video, 'frames': frames, 'baseline': summarize(*baseline), 'results': results},
+                  f, indent=2)
+    print(f"Saved results to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,65 +1,104 @@
 import cv2 as cv
+import itertools
 import threading
-import pandas as pd
 from detector import YOLODetector
+from engine import InferenceEngine
+from workers import WorkerPool
+from frameslot import LatestFrame
+from metrics import METRICS
+from mjpeg import MJPEGCapture, MJPEGIngest, decode_for_detector, retrieve_for_slot
+from controller import LatencyController
+from recorder import ClipWriter, ClipRecorder
+from detlog import DetectionLog
+from zones import ZoneSet, draw_interest_area, load_zones
+from config import ConfigWatcher, load_cameras
+from viewer import Viewer
 from rpi_relays import RaspberryRelayLogic
-import queue
+import argparse
 import time
 
-def get_camera_streams(csv_path):
-    """Read camera streams, coordinates, and pin numbers from a CSV file."""
-    camera_df = pd.read_csv(csv_path, header=None)
-    camera_streams = camera_df.iloc[:, 0].tolist()
-    camera_cords = [None] * len(camera_streams)
-    camera_pins = []
-
-    if camera_df.shape[1] > 1:
-        for i in range(len(camera_streams)):
-            cords = camera_df.iloc[i, 1]
-            if pd.notna(cords):
-                camera_cords[i] = tuple(map(int, str(cords).split(',')))
-
-    if camera_df.shape[1] > 2:
-        camera_pins = [tuple(map(int, str(pins).split(','))) for pins in camera_df.iloc[:, 2]]
-
-    return camera_streams, camera_cords, camera_pins
-
 class CameraHandler:
 
-    def __init__(self, stream_url, relay_logic, frame_queue, processed_frame_queue, interest_area=None):
+    def __init__(self, stream_url, relay_logic, frame_slot, interest_area=None, detector=None,
+                 capture_factory=cv.VideoCapture, name=None, recorder=None, detection_log=None, camera_id=0):
         self.stream_url = stream_url
+        self.name = name if name is not None else stream_url  # Label for reports and metrics
         self.relay_logic = relay_logic
-        self.frame_queue = frame_queue
-        self.processed_frame_queue = processed_frame_queue
-        self.yolo_detector = YOLODetector()
+        self.relay_lock = threading.Lock()  # Held while a frame is signalled, so relay_logic can be swapped safely
+        self.frame_slot = frame_slot
+        self.results = LatestFrame()  # (frame, detections, interest_area) of the last processed frame
+        self.yolo_detector = detector if detector is not None else YOLODetector()
+        self.yolo_detector.camera = self.name
+        self.yolo_detector.drawDetections = False  # Frames are only annotated when a viewer asks, see annotated_frame
         self.interest_area = interest_area
-        self.frame_lock = threading.Lock()
+        self.capture_factory = capture_factory  # cv.VideoCapture or MJPEGIngest.capture
+        self.target_fps = None  # Processing rate cap, set by LatencyController
+        self.latency = 0.0  # Smoothed capture-to-relay latency in seconds
+        self.intersection = False
+        self.recorder = recorder  # ClipRecorder for event clips, or None
+        self.detection_log = detection_log
+        self.camera_id = camera_id  # Camera number in the detection log
+        self.running = True
+        self.threads = []
+
+    def start(self):
+        # Never daemon threads, even when started from the daemon config watcher on a reload
+        self.threads = [threading.Thread(target=self.capture_video, daemon=False),
+                        threading.Thread(target=self.process_video, daemon=False)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """Let both threads finish, e.g. when the camera is removed from the config."""
+        self.running = False
 
     def capture_video(self):
         max_reconnect_attempts = 5
         reconnect_delay = 10  # Delay in seconds
 
-        while True:
-            cap = cv.VideoCapture(self.stream_url)
+        while self.running:
+            cap = self.capture_factory(self.stream_url)
             if not cap.isOpened():
                 print(f"Failed to open stream: {self.stream_url}")
                 return
 
             reconnect_attempts = 0
-            while reconnect_attempts < max_reconnect_attempts:
-                ret, frame = cap.read()
-                if not ret:
+            while self.running and reconnect_attempts < max_reconnect_attempts:
+                start = METRICS.start()
+                if not cap.grab():
+                    if not self.running:
+                        break  # Stopped while waiting for a frame; don't open the stream again
                     print(f"Stream lost, attempting to reconnect {self.stream_url}")
+                    if not isinstance(cap, MJPEGCapture):
+                        METRICS.inc('reconnects', self.name)  # MJPEGIngest counts its own reconnections
                     cap.release()
                     time.sleep(reconnect_delay)
-                    cap = cv.VideoCapture(self.stream_url)
+                    if not self.running:
+                        return
+                    cap = self.capture_factory(self.stream_url)
                     reconnect_attempts += 1
                     continue
+                METRICS.stop(start, 'capture', self.name)
+                METRICS.inc('frames_captured', self.name)
 
-                with self.frame_lock:
-                    if self.frame_queue.empty():  # Only put the frame if the queue is empty
-                        self.frame_queue.put((self.stream_url, frame))
-                reconnect_attempts = 0  # Reset reconnect attempts after a successful frame read
+                reconnect_attempts = 0  # Reset reconnect attempts after a successful frame grab
+
+                jpeg = getattr(cap, 'jpeg', None)
+                if self.recorder is not None and jpeg is not None:
+                    self.recorder.add(jpeg)  # The camera's own JPEG, recorded without decoding
+
+                # A VideoCapture has decoded the frame in grab() already, but retrieve() still converts it to BGR.
+                # JPEG bytes from an MJPEGCapture cost nothing to publish, so every one of them is.
+                if jpeg is None and not self.frame_slot.wanted():
+                    self.frame_slot.skip()  # Nobody is waiting for this frame: skip the conversion
+                    continue
+                start = METRICS.start()
+                ret, frame = retrieve_for_slot(cap)
+                METRICS.stop(start, 'retrieve', self.name)
+                if ret and self.recorder is not None and jpeg is None:
+                    self.recorder.add(frame)  # Only frames decoded anyway are encoded for the buffer
+                if ret:
+                    self.frame_slot.publish(frame)  # Replaces any frame the processing thread hasn't picked up
 
             if reconnect_attempts >= max_reconnect_attempts:
                 print(f"Failed to reconnect after {max_reconnect_attempts} attempts: {self.stream_url}")
@@ -70,52 +109,246 @@ class CameraHandler:
 
 
     def process_video(self):
-        while True:
-            _, frame = self.frame_queue.get()
-            if self.interest_area:
-                cv.rectangle(frame, (self.interest_area[0], self.interest_area[1]),
-                             (self.interest_area[0] + self.interest_area[2],
-                              self.interest_area[1] + self.interest_area[3]), (0, 255, 0), 2)
+        seq = 0
+        report_interval = 60  # Seconds between frame statistics reports
+        last_report = time.monotonic()
+        while self.running:
+            latest = self.frame_slot.wait_newer(seq, timeout=1.0)  # Timeout so stop() is noticed
+            if latest is None:
+                continue
+            seq, item, captured = latest
+            started = time.monotonic()
+            # Compressed frames are decoded here, at the smallest scale the detector can use
+            start = METRICS.start()
+            frame, interest_area, scale = decode_for_detector(item, self.yolo_detector, self.interest_area)
+            METRICS.stop(start, 'decode', self.name)
+            if frame is None:
+                continue
+
+            try:
+                _, intersection, count = self.yolo_detector.process_frame(frame, interest_area)
+            except Exception as e:
+                print(f"Detection failed for {self.name}: {e}")  # e.g. a dead or hung worker; try the next frame
+                continue
+            start = METRICS.start()
+            with self.relay_lock:
+                self.relay_logic.update_relay_status(intersection, count)
+            METRICS.stop(start, 'relay', self.name)
+            self.intersection = intersection
+            if self.recorder is not None:
+                self.recorder.update(intersection)
+            if self.detection_log is not None:
+                self.detection_log.log(self.camera_id, time.time(), self.yolo_detector.last_detections,
+                                       self.yolo_detector.box_hits, scale)  # In stream coordinates, whatever the scale
+            self.latency = 0.8 * self.latency + 0.2 * (time.monotonic() - captured)
+            # Keep only the newest result, by reference; nothing is copied or drawn unless someone looks
+            self.results.publish((frame, self.yolo_detector.last_detections, interest_area))
+
+            if time.monotonic() - last_report > report_interval:
+                self.frame_slot.report(self.name, self.yolo_detector.motion_gate)
+                last_report = time.monotonic()
 
-            processed_frame, intersection, count = self.yolo_detector.process_frame(frame, self.interest_area)
-            self.relay_logic.update_relay_status(intersection, count)
-            self.processed_frame_queue.put((self.stream_url, processed_frame))
+            if self.target_fps:
+                # Frames arriving meanwhile just replace each other in frame_slot
+                delay = 1 / self.target_fps - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
 
+    def annotated_frame(self):
+        """Copy of the last processed frame with the AOI and detections drawn, or None before the first one."""
+        _, result = self.results.peek()
+        if result is None:
+            return None
+        frame, detections, interest_area = result
+        frame = frame.copy()
+        draw_interest_area(frame, interest_area)
+        self.yolo_detector.draw_detections(frame, detections)
+        return frame
 
-def display_frames(processed_frame_queues, window_names):
+
+def display_frames(handlers):
+    shown = {}  # handler -> result sequence number last shown; handlers come and go with config reloads
     while True:
-        for stream_url, processed_frame_queue in processed_frame_queues.items():
-            if not processed_frame_queue.empty():
-                _, frame = processed_frame_queue.get()
-                window_name = window_names[stream_url]
-                cv.imshow(window_name, frame)
+        current = list(handlers)
+        for handler in [handler for handler in shown if handler not in current]:
+            del shown[handler]  # Removed from the config: forget it and close its window
+            cv.destroyWindow(handler.name)
+        for handler in current:
+            seq, _ = handler.results.peek()
+            if seq > shown.get(handler, 0):
+                shown[handler] = seq
+                start = METRICS.start()
+                cv.imshow(handler.name, handler.annotated_frame())
+                METRICS.stop(start, 'display', handler.name)
         if cv.waitKey(1) & 0xFF == ord('q'):
             break
     cv.destroyAllWindows()
 
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Multi-camera train detection")
+    parser.add_argument('--csv', default='cam_list.csv', help="Camera list CSV")
+    parser.add_argument('--max-batch', type=int, default=8, help="Max frames per forward pass")
+    parser.add_argument('--max-wait', type=float, default=0.01, help="Max seconds to wait for a fuller batch")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="Number of detection worker processes (0 runs detection in this process)")
+    parser.add_argument('--aoi-crop', action='store_true', help="Run the network on the interest area only")
+    parser.add_argument('--aoi-margin', type=float, default=0.25, help="Crop margin as a fraction of the AOI size")
+    parser.add_argument('--motion-threshold', type=float, default=None,
+                        help="Skip inference while less than this fraction of the AOI changes")
+    parser.add_argument('--motion-refresh', type=int, default=25, help="Force an inference every N skipped frames")
+    parser.add_argument('--keyframe-interval', type=int, default=None,
+                        help="Run the network every N frames and track boxes in between")
+    parser.add_argument('--mjpeg-ingest', action='store_true',
+                        help="Read all MJPEG streams on one asyncio loop instead of a VideoCapture each")
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help="Serve Prometheus metrics on this local port (0 disables metrics)")
+    parser.add_argument('--latency-budget', type=float, default=None,
+                        help="Adapt input size and frame rate per camera to keep latency under this many seconds")
+    parser.add_argument('--relay-debounce', type=int, default=3,
+                        help="Frames a new signal state must persist before the relay switches (red switches at once)")
+    parser.add_argument('--clip-dir', default=None,
+                        help="Record a clip around every intersection event into this directory")
+    parser.add_argument('--pre-roll', type=float, default=5.0, help="Seconds recorded before an event")
+    parser.add_argument('--post-roll', type=float, default=5.0, help="Seconds recorded after an event")
+    parser.add_argument('--clip-buffer-mb', type=float, default=8.0, help="Pre-roll buffer size per camera")
+    parser.add_argument('--detection-log', default=None, help="Append every detection to logs in this directory")
+    parser.add_argument('--zones', default=None,
+                        help="JSON file of named polygon zones per camera, used instead of the CSV interest area")
+    parser.add_argument('--viewer-port', type=int, default=0,
+                        help="Serve a browser viewer with a camera mosaic on this port (0 disables it)")
+    parser.add_argument('--viewer-host', default='127.0.0.1', help="Address the viewer listens on")
+    parser.add_argument('--viewer-fps', type=float, default=5, help="Frame rate cap of viewer streams")
+    parser.add_argument('--headless', action='store_true',
+                        help="No display windows; frames are only annotated for viewer clients, if any")
+    return parser.parse_args()
+
+
 def main():
-    csv_path = 'cam_list.csv'
-    camera_streams, camera_cords, camera_pins = get_camera_streams(csv_path)
+    args = parse_args()
+    if args.metrics_port:
+        METRICS.serve(args.metrics_port)
+    csv_path = args.csv
+    cameras = load_cameras(csv_path)
+    detector_args = dict(aoiCrop=args.aoi_crop, aoiMargin=args.aoi_margin,
+                         motionThreshold=args.motion_threshold, motionRefresh=args.motion_refresh,
+                         keyframeInterval=args.keyframe_interval)
+    if args.workers > 0:
+        engine = WorkerPool(args.workers, **detector_args).start()
+    else:
+        engine = InferenceEngine(YOLODetector(**detector_args), max_batch_size=args.max_batch,
+                                 max_wait=args.max_wait).start()
+
+    mjpeg_ingest = MJPEGIngest().start() if args.mjpeg_ingest else None
+    capture_factory = mjpeg_ingest.capture if mjpeg_ingest is not None else cv.VideoCapture
+
+    zone_sets = load_zones(args.zones) if args.zones else {}
 
-    frame_queues = {stream_url: queue.Queue() for stream_url in camera_streams}
-    processed_frame_queues = {stream_url: queue.Queue() for stream_url in camera_streams}
-    window_names = {stream_url: f"Camera {index}" for index, stream_url in enumerate(camera_streams)}
+    handlers = []
+    running = {}  # stream URL -> CameraHandler
+    camera_ids = itertools.count()  # Ids are never reused, so log records of a removed camera stay apart
+    controller = LatencyController(args.latency_budget).start() if args.latency_budget else None
+    clip_writer = ClipWriter(args.clip_dir).start() if args.clip_dir else None
+    detection_log = DetectionLog(args.detection_log).start() if args.detection_log else None
 
-    for index, (stream_url, cords, pins) in enumerate(zip(camera_streams, camera_cords, camera_pins)):
-        relay_logic = RaspberryRelayLogic(*pins)  # Initialize appropriately
+    def interest_area_for(camera):
+        # Zones are keyed by stream URL or by the camera's row in the current CSV
+        row = [c.stream_url for c in watcher.cameras].index(camera.stream_url)
+        interest_area = zone_sets.get(camera.stream_url, zone_sets.get(str(row)))
+        if interest_area is None and camera.interest_area is not None:
+            interest_area = ZoneSet.from_rect(camera.interest_area)  # CSV coordinates are x,y,w,h
+        return interest_area
 
-        if cords is None:
-            print(f"No coordinates found for stream: {stream_url}")
-            continue
+    def start_camera(camera):
+        # With a detection log the id of a stream is kept across restarts, so its records stay together
+        index = detection_log.camera_id(camera.stream_url) if detection_log is not None else next(camera_ids)
+        name = f"Camera {index}"
+        interest_area = interest_area_for(camera)
+        if interest_area is None:
+            print(f"No coordinates found for stream: {camera.stream_url}")
+            return
+        if camera.pins is None:
+            print(f"No relay pins found for stream: {camera.stream_url}")
+            return
+        relay_logic = RaspberryRelayLogic(*camera.pins, debounce=args.relay_debounce, name=name)
+
+        recorder = None
+        if clip_writer is not None:
+            recorder = ClipRecorder(clip_writer, name, pre_roll=args.pre_roll,
+                                    post_roll=args.post_roll, max_bytes=int(args.clip_buffer_mb * 1024 * 1024))
+        if detection_log is not None:
+            detection_log.name_camera(index, name)
+        if mjpeg_ingest is not None:
+            mjpeg_ingest.add_stream(camera.stream_url, name)  # Before the first capture, so metrics use the name
+        # Detectors share the engine's network, so adding a camera never loads the model again
+        camera_handler = CameraHandler(camera.stream_url, relay_logic, LatestFrame(name), interest_area=interest_area,
+                                       detector=engine.detector_for_camera(), capture_factory=capture_factory,
+                                       name=name, recorder=recorder, detection_log=detection_log, camera_id=index)
+        camera_handler.start()
+        handlers.append(camera_handler)
+        running[camera.stream_url] = camera_handler
+        if controller is not None:
+            controller.add(camera_handler)
+
+    def stop_camera(stream_url):
+        camera_handler = running.pop(stream_url, None)
+        if camera_handler is None:
+            return
+        camera_handler.stop()
+        if mjpeg_ingest is not None:
+            mjpeg_ingest.remove_stream(stream_url)
+        handlers.remove(camera_handler)
+        if controller is not None:
+            controller.remove(camera_handler)
+        threading.Thread(target=release_camera, args=(camera_handler,), daemon=True).start()
+        print(f"Stopped {camera_handler.name}: {stream_url}")
+
+    def release_camera(camera_handler):
+        # Only once both threads are done can nothing be detecting or recording for the camera any more
+        for thread in camera_handler.threads:
+            thread.join()
+        camera_handler.relay_logic.switch_off()  # After the joins, so no frame in flight can light a pin again
+        engine.release_detector(camera_handler.yolo_detector)
+        if camera_handler.recorder is not None:
+            camera_handler.recorder.close()
+
+    def apply_config(added, removed, changed):
+        for camera in removed:
+            stop_camera(camera.stream_url)
+        for old, camera in changed:
+            camera_handler = running.get(camera.stream_url)
+            if camera_handler is None or camera.pins is None:
+                stop_camera(camera.stream_url)
+                start_camera(camera)  # Not running before, e.g. it had no interest area yet
+                continue
+            if camera.interest_area != old.interest_area:
+                interest_area = interest_area_for(camera)
+                if interest_area is None:
+                    stop_camera(camera.stream_url)
+                    continue
+                camera_handler.interest_area = interest_area  # Picked up with the next frame
+            if camera.pins != old.pins:
+                relay_logic = RaspberryRelayLogic(*camera.pins, debounce=args.relay_debounce, name=camera_handler.name)
+                with camera_handler.relay_lock:  # Waits for a frame being signalled on the old pins
+                    old_relay, camera_handler.relay_logic = camera_handler.relay_logic, relay_logic
+                old_relay.switch_off()  # Later frames only reach the new pins
+            print(f"Updated {camera_handler.name}: {camera.stream_url}")
+        for camera in added:
+            start_camera(camera)
 
-        camera_handler = CameraHandler(stream_url, relay_logic, frame_queues[stream_url],
-                                       processed_frame_queues[stream_url], interest_area=cords)
-        threading.Thread(target=camera_handler.capture_video).start()
-        threading.Thread(target=camera_handler.process_video).start()
+    watcher = ConfigWatcher(csv_path, apply_config, cameras)
+    for camera in cameras:
+        start_camera(camera)
+    watcher.start()
+    if args.viewer_port:
+        Viewer(handlers, max_fps=args.viewer_fps).serve(args.viewer_port, args.viewer_host)
 
-    display_frames(processed_frame_queues, window_names)
+    if args.headless:
+        # Camera threads come and go with reloads; the process lives until it is killed, even with none left
+        threading.Event().wait()
+    else:
+        display_frames(handlers)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,92 @@
+import os
+import cv2 as cv
+import numpy as np
+import pytest
+from detector import YOLODetector
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class OfflineDetector(YOLODetector):
+    def load_net(self, modelConf, modelWeights):
+        return None
+
+
+def reference_decode(outs, frameWidth, frameHeight, confThreshold):
+    """The per-row loop postprocess used before decoding was vectorised."""
+    classIDs, confidences, boxes = [], [], []
+    for out in outs:
+        for detection in out:
+            scores = detection[5:]
+            classID = np.argmax(scores)
+            confidence = scores[classID]
+            if confidence > confThreshold:
+                centerX, centerY = int(detection[0] * frameWidth), int(detection[1] * frameHeight)
+                width, height = int(detection[2] * frameWidth), int(detection[3] * frameHeight)
+                left, top = int(centerX - width / 2), int(centerY - height / 2)
+                boxes.append([left, top, width, height])
+                classIDs.append(classID)
+                confidences.append(float(confidence))
+    return classIDs, confidences, boxes
+
+
+def reference_nms(outs, frameWidth, frameHeight, confThreshold, nmsThreshold):
+    classIDs, confidences, boxes = reference_decode(outs, frameWidth, frameHeight, confThreshold)
+    indices = cv.dnn.NMSBoxes(boxes, confidences, confThreshold, nmsThreshold)
+    return [classIDs[i] for i in indices], [confidences[i] for i in indices], [boxes[i] for i in indices]
+
+
+@pytest.fixture
+def detector():
+    return OfflineDetector(classesFile=os.path.join(ROOT, 'obj.names'))
+
+
+def random_outs(rng, rows=(507, 2028), classes=1, hit_rate=0.05):
+    """Raw output of the two yolo layers: centres/sizes in 0..1, mostly low scores."""
+    outs = []
+    for count in rows:
+        out = rng.random((count, 5 + classes), dtype=np.float32)
+        out[:, 2:4] *= 0.5
+        out[:, 5:] *= np.where(rng.random((count, 1)) < hit_rate, 1.0, 0.4).astype(np.float32)
+        outs.append(out)
+    return outs
+
+
+def assert_same(decoded, expected):
+    classIDs, confidences, boxes = decoded
+    assert classIDs.tolist() == [int(c) for c in expected[0]]
+    np.testing.assert_array_equal(confidences, np.asarray(expected[1], dtype=np.float32))
+    assert boxes.reshape(-1, 4).tolist() == [list(box) for box in expected[2]]
+
+
+def test_decode_matches_loop(detector):
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        width, height = int(rng.integers(160, 1921)), int(rng.integers(120, 1081))
+        detector.confThreshold = float(rng.uniform(0.3, 0.7))
+        outs = random_outs(rng, classes=int(rng.integers(1, 4)))
+        assert_same(detector.decode(outs, width, height),
+                    reference_decode(outs, width, height, detector.confThreshold))
+        assert_same(detector.nms(*detector.decode(outs, width, height)),
+                    reference_nms(outs, width, height, detector.confThreshold, detector.nmsThreshold))
+
+
+def test_decode_batch_matches_loop(detector):
+    rng = np.random.default_rng(1)
+    for _ in range(50):
+        sizes = [(int(rng.integers(160, 1921)), int(rng.integers(120, 1081))) for _ in range(int(rng.integers(1, 6)))]
+        frames = [random_outs(rng, hit_rate=float(rng.choice([0.0, 0.05]))) for _ in sizes]
+        batched = [np.stack([outs[layer] for outs in frames]) for layer in range(2)]
+        decoded = detector.decode_batch(batched, sizes)
+        assert len(decoded) == len(sizes)
+        for result, outs, (width, height) in zip(decoded, frames, sizes):
+            assert_same(result, reference_decode(outs, width, height, detector.confThreshold))
+
+
+def test_decode_without_detections(detector):
+    outs = [np.zeros((507, 6), dtype=np.float32), np.zeros((2028, 6), dtype=np.float32)]
+    classIDs, confidences, boxes = detector.nms(*detector.decode(outs, 640, 480))
+    assert len(classIDs) == len(confidences) == len(boxes) == 0
+    assert boxes.shape == (0, 4)
+    for classIDs, confidences, boxes in detector.decode_batch([out[None].repeat(3, 0) for out in outs], [(640, 480)] * 3):
+        assert len(classIDs) == 0 and boxes.shape == (0, 4)
@@ -0,0 +1,130 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import cv2 as cv
+import numpy as np
+import pytest
+from metrics import METRICS
+from mjpeg import MJPEGIngest, decode_for_detector, decode_jpeg, jpeg_size
+
+
+def make_jpeg(index, width=64, height=48):
+    frame = np.full((height, width, 3), index * 20 % 256, dtype=np.uint8)
+    ret, encoded = cv.imencode('.jpg', frame)
+    assert ret
+    return encoded.tobytes()
+
+
+class StandInCamera:
+    """Local MJPEG camera: serves frames as multipart parts, with or without Content-Length.
+
+    Each connection sends frames_per_connection parts and then hangs up,
+    like a camera that drops its clients now and then.
+    """
+
+    def __init__(self, content_length=True, frames_per_connection=None, boundary='--myboundary'):
+        self.content_length = content_length
+        self.frames_per_connection = frames_per_connection
+        self.boundary = boundary
+        self.connections = 0
+        self.request_versions = []
+        self.sent = threading.Event()
+        camera = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                camera.connections += 1
+                camera.request_versions.append(self.request_version)
+                self.send_response(200)
+                self.send_header('Content-Type', f'multipart/x-mixed-replace; boundary={camera.boundary}')
+                self.end_headers()
+                delimiter = b'--' + camera.boundary.lstrip('-').encode()
+                index = 0
+                try:
+                    while not camera.sent.is_set():
+                        if camera.frames_per_connection is not None and index == camera.frames_per_connection:
+                            break
+                        jpeg = make_jpeg(index)
+                        headers = b'Content-Type: image/jpeg\r\n'
+                        if camera.content_length:
+                            headers += b'Content-Length: ' + str(len(jpeg)).encode() + b'\r\n'
+                        self.wfile.write(delimiter + b'\r\n' + headers + b'\r\n' + jpeg + b'\r\n')
+                        self.wfile.flush()
+                        index += 1
+                        camera.sent.wait(0.01)
+                    if not camera.content_length:
+                        self.wfile.write(delimiter + b'--\r\n')  # Closing delimiter ends the last part
+                except OSError:
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/video.mjpg'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.sent.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def ingest():
+    ingest = MJPEGIngest(connect_timeout=2, read_timeout=2, min_backoff=0.05, max_backoff=0.1).start()
+    yield ingest
+    ingest.stop()
+
+
+def receive(stream, count, timeout=5):
+    frames, seq = [], 0
+    while len(frames) < count:
+        latest = stream.frames.wait_newer(seq, timeout)
+        assert latest is not None, f"only {len(frames)} of {count} frames arrived"
+        seq, jpeg, _ = latest
+        frames.append(jpeg)
+    return frames
+
+
+@pytest.mark.parametrize('content_length', [True, False], ids=['content-length', 'boundary-only'])
+def test_parts_arrive_intact(ingest, content_length):
+    camera = StandInCamera(content_length=content_length)
+    try:
+        stream = ingest.add_stream(camera.url)
+        for jpeg in receive(stream, 10):
+            assert jpeg.startswith(b'\xff\xd8') and jpeg.endswith(b'\xff\xd9')
+            assert jpeg_size(jpeg) == (64, 48)
+            assert decode_jpeg(jpeg).shape == (48, 64, 3)
+        assert camera.request_versions[0] == 'HTTP/1.0'
+    finally:
+        camera.close()
+
+
+def test_boundary_only_part_matches_sent_jpeg(ingest):
+    camera = StandInCamera(content_length=False, frames_per_connection=1)
+    try:
+        stream = ingest.add_stream(camera.url)
+        assert receive(stream, 1)[0] == make_jpeg(0)
+    finally:
+        camera.close()
+
+
+@pytest.mark.parametrize('content_length', [True, False], ids=['content-length', 'boundary-only'])
+def test_reconnects_after_server_hangs_up(ingest, content_length, monkeypatch):
+    monkeypatch.setattr(METRICS, 'enabled', True)
+    camera = StandInCamera(content_length=content_length, frames_per_connection=3)
+    try:
+        stream = ingest.add_stream(camera.url)
+        receive(stream, 8)
+        assert camera.connections >= 3
+        assert stream.reconnects >= 2
+        assert METRICS.counters[('reconnects', camera.url)] >= 2  # Labelled by URL unless named
+    finally:
+        camera.close()
+
+
+@pytest.mark.parametrize('jpeg', [b'\xff\xd8\x00\x10garbage garbage', b'\xff\xd8\xff\xe0\x00'],
+                         ids=['bad-marker', 'truncated'])
+def test_corrupt_jpeg_is_skipped(jpeg):
+    assert decode_for_detector(jpeg, None, (1, 2, 3, 4)) == (None, (1, 2, 3, 4), 1.0)
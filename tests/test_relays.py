@@ -0,0 +1,72 @@
+import pytest
+from rpi_relays import GREEN, RED, YELLOW, MockGPIO, RaspberryRelayLogic, RelayActuator
+
+PINS = (17, 27, 22)
+
+
+@pytest.fixture
+def relay():
+    return RaspberryRelayLogic(*PINS, gpio=MockGPIO(), actuator=RelayActuator().start(), debounce=3)
+
+
+def lit(relay):
+    relay.actuator.join()
+    return [pin for pin in PINS if relay.gpio.pins[pin] == MockGPIO.HIGH]
+
+
+def test_red_switches_at_once(relay):
+    relay.update_relay_status(True, 1)
+    assert relay.state == RED
+    assert lit(relay) == [relay.red_pin]
+
+
+def test_other_states_wait_for_debounce(relay):
+    relay.update_relay_status(True, 1)
+    for _ in range(2):
+        relay.update_relay_status(False, 0)
+    assert relay.state == RED
+    relay.update_relay_status(False, 0)
+    assert relay.state == GREEN
+    assert lit(relay) == [relay.green_pin]
+    assert relay.transitions == 2
+
+
+def test_flicker_is_ignored(relay):
+    relay.update_relay_status(True, 1)
+    for intersection, count in [(False, 0), (False, 0), (True, 5), (False, 0), (False, 0)]:
+        relay.update_relay_status(intersection, count)
+    assert relay.state == RED
+    assert relay.transitions == 1
+
+
+def test_countdown_keeps_state(relay):
+    relay.update_relay_status(True, 1)
+    for _ in range(5):
+        relay.update_relay_status(False, 7)  # Train gone, detector still counting down
+    assert relay.state == RED
+
+
+def test_yellow_after_long_intersection(relay):
+    relay.update_relay_status(True, 99)
+    for _ in range(3):
+        relay.update_relay_status(True, 100)
+    assert relay.state == YELLOW
+    assert lit(relay) == [relay.yellow_pin]
+
+
+def test_switch_off(relay):
+    relay.update_relay_status(True, 1)
+    relay.switch_off()
+    assert lit(relay) == []
+
+
+def test_actuator_writes_only_newest_state():
+    actuator = RelayActuator()  # Not started yet, so every request below is still pending
+    relay = RaspberryRelayLogic(*PINS, gpio=MockGPIO(), actuator=actuator, debounce=1)
+    relay.update_relay_status(True, 1)
+    relay.update_relay_status(False, 0)
+    relay.update_relay_status(True, 1)
+    assert relay.transitions == 3
+    actuator.start().join()
+    assert relay.gpio.writes == len(PINS)  # One write of the three pins
+    assert lit(relay) == [relay.red_pin]
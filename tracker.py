@@ -0,0 +1,92 @@
+import numpy as np
+
+
+def iou_matrix(a, b):
+    """Pairwise IoU of two (N, 4) and (M, 4) arrays of left/top/width/height boxes."""
+    a = a.astype(np.float32)[:, None, :]
+    b = b.astype(np.float32)[None, :, :]
+    left = np.maximum(a[..., 0], b[..., 0])
+    top = np.maximum(a[..., 1], b[..., 1])
+    right = np.minimum(a[..., 0] + a[..., 2], b[..., 0] + b[..., 2])
+    bottom = np.minimum(a[..., 1] + a[..., 3], b[..., 1] + b[..., 3])
+    inter = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+    union = a[..., 2] * a[..., 3] + b[..., 2] * b[..., 3] - inter
+    return inter / np.maximum(union, 1e-6)
+
+
+class BoxTracker:
+    """Carries detections forward between keyframes with a constant-velocity model.
+
+    At every keyframe the detector's boxes replace the tracks; boxes that
+    overlap a previous track by at least min_iou inherit its identity and get
+    a per-frame velocity from the displacement since the last keyframe. On the
+    frames in between, predict() moves every box by its velocity.
+
+    The keyframe interval adapts: max_interval while nothing is tracked,
+    min_interval while a box sits on the AOI edge, interval otherwise.
+    """
+
+    def __init__(self, interval=5, min_interval=1, max_interval=None, min_iou=0.3, edge_margin=0.2):
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval if max_interval is not None else 3 * interval
+        self.min_iou = min_iou
+        self.edge_margin = edge_margin  # Width of the AOI edge band, as a fraction of the AOI size
+        self.classIDs = np.zeros(0, dtype=np.int64)
+        self.confidences = np.zeros(0, dtype=np.float32)
+        self.boxes = np.zeros((0, 4), dtype=np.float32)
+        self.velocities = np.zeros((0, 2), dtype=np.float32)
+        self.frames_since_keyframe = 0
+        self.keyframes = 0
+        self.tracked_frames = 0
+
+    def detections(self):
+        return self.classIDs, self.confidences, np.round(self.boxes).astype(np.int32)
+
+    def update(self, detections):
+        """Replace the tracks with keyframe detections, keeping velocities of matched boxes."""
+        classIDs, confidences, boxes = detections
+        boxes = boxes.astype(np.float32)
+        velocities = np.zeros((len(boxes), 2), dtype=np.float32)
+        if len(boxes) and len(self.boxes):
+            overlaps = iou_matrix(boxes, self.boxes)
+            # Greedy matching, best overlaps first
+            for flat in np.argsort(overlaps, axis=None)[::-1]:
+                new, old = np.unravel_index(flat, overlaps.shape)
+                if overlaps[new, old] < self.min_iou:
+                    break
+                velocities[new] = (boxes[new, :2] - self.boxes[old, :2]) / (self.frames_since_keyframe + 1)
+                overlaps[new, :] = -1
+                overlaps[:, old] = -1
+        self.classIDs, self.confidences, self.boxes, self.velocities = classIDs, confidences, boxes, velocities
+        self.frames_since_keyframe = 0
+        self.keyframes += 1
+
+    def predict(self):
+        self.boxes[:, :2] += self.velocities
+        self.frames_since_keyframe += 1
+        self.tracked_frames += 1
+        return self.detections()
+
+    def near_edge(self, aoi):
+        """True if any tracked box overlaps the band around the (left, top, right, bottom) AOI border."""
+        if aoi is None or not len(self.boxes):
+            return False
+        x1, y1, x2, y2 = aoi
+        marginX, marginY = (x2 - x1) * self.edge_margin, (y2 - y1) * self.edge_margin
+        left, top = self.boxes[:, 0], self.boxes[:, 1]
+        right, bottom = left + self.boxes[:, 2], top + self.boxes[:, 3]
+        touches_outer = (left < x2 + marginX) & (right > x1 - marginX) & (top < y2 + marginY) & (bottom > y1 - marginY)
+        inside_inner = (left >= x1 + marginX) & (right <= x2 - marginX) & (top >= y1 + marginY) & (bottom <= y2 - marginY)
+        return bool(np.any(touches_outer & ~inside_inner))
+
+    def is_keyframe(self, aoi):
+        if self.keyframes == 0:
+            return True
+        if not len(self.boxes):
+            interval = self.max_interval
+        elif self.near_edge(aoi):
+            interval = self.min_interval
+        else:
+            interval = self.interval
+        return self.frames_since_keyframe + 1 >= interval
@@ -0,0 +1,203 @@
+import html
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import cv2 as cv
+import numpy as np
+from metrics import METRICS
+
+BOUNDARY = b'frame'
+
+
+class SharedStream:
+    """Latest JPEG of one view, encoded by whichever client needs it next, at most max_fps times a second.
+
+    There is no encoder thread: with no clients connected nothing is drawn
+    or encoded at all. Clients of the same view share every encoded frame,
+    and a frame is only encoded when its source has a newer result.
+    """
+
+    def __init__(self, key, render, max_fps=5, quality=70):
+        self.key = key  # Returns a value that changes whenever the view has something new
+        self.render = render  # Returns the BGR image of the view, or None
+        self.interval = 1 / max_fps
+        self.quality = quality
+        self.cond = threading.Condition()
+        self.clients = 0
+        self.encoding = False
+        self.encoded_at = 0.0
+        self.last_key = None
+        self.version = 0
+        self.jpeg = None
+
+    def next(self, version, timeout=10):
+        """Block until a JPEG newer than version exists; return (version, jpeg), or (version, None) on timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.cond:
+                if self.version > version:
+                    return self.version, self.jpeg
+                now = time.monotonic()
+                if now > deadline:
+                    return version, None
+                wait = self.encoded_at + self.interval - now
+                if self.encoding or wait > 0:
+                    self.cond.wait(max(wait, 0.01))
+                    continue
+                self.encoding = True
+            key, jpeg = self.key(), None
+            try:
+                if key != self.last_key:
+                    frame = self.render()
+                    if frame is not None:
+                        ret, encoded = cv.imencode('.jpg', frame, [cv.IMWRITE_JPEG_QUALITY, self.quality])
+                        jpeg = encoded.tobytes() if ret else None
+            finally:
+                with self.cond:
+                    self.encoding = False
+                    self.encoded_at = time.monotonic()
+                    if jpeg is not None:
+                        self.last_key, self.jpeg = key, jpeg
+                        self.version += 1
+                    self.cond.notify_all()
+
+
+def mosaic(handlers, tile_width=480):
+    """Tile the annotated frames of handlers in a near-square grid, tiles tile_width wide at 16:9."""
+    tile_height = tile_width * 9 // 16
+    columns = max(1, math.ceil(math.sqrt(len(handlers))))
+    rows = max(1, math.ceil(len(handlers) / columns))
+    canvas = np.zeros((rows * tile_height, columns * tile_width, 3), dtype=np.uint8)
+    for index, handler in enumerate(handlers):
+        top, left = (index // columns) * tile_height, (index % columns) * tile_width
+        frame = handler.annotated_frame()
+        if frame is not None:
+            # Fit inside the tile, keeping the aspect ratio
+            scale = min(tile_width / frame.shape[1], tile_height / frame.shape[0])
+            width, height = int(frame.shape[1] * scale), int(frame.shape[0] * scale)
+            canvas[top:top + height, left:left + width] = cv.resize(frame, (width, height), interpolation=cv.INTER_AREA)
+        cv.putText(canvas, handler.name, (left + 8, top + 22), cv.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+    return canvas
+
+
+class Viewer:
+    """HTTP viewer for the cameras of test_multi.py: / lists them, /mosaic and /camera/<id> are MJPEG streams.
+
+    handlers is the live list of CameraHandlers, so cameras added or
+    removed by a config reload show up without restarting the viewer.
+    """
+
+    def __init__(self, handlers, max_fps=5, quality=70, tile_width=480):
+        self.handlers = handlers
+        self.max_fps = max_fps
+        self.quality = quality
+        self.tile_width = tile_width
+        self.lock = threading.Lock()
+        self.streams = {}  # view name -> SharedStream, only while it has clients
+
+    def find(self, camera_id):
+        for handler in list(self.handlers):
+            if str(handler.camera_id) == camera_id:
+                return handler
+        return None
+
+    def make_stream(self, view):
+        if view == 'mosaic':
+            def key():
+                return tuple((id(handler), handler.results.peek()[0]) for handler in list(self.handlers))
+
+            def render():
+                return mosaic(list(self.handlers), self.tile_width)
+        else:
+            handler = self.find(view)
+            if handler is None:
+                return None
+
+            def key():
+                return handler.results.peek()[0]
+
+            render = handler.annotated_frame
+        return SharedStream(key, render, self.max_fps, self.quality)
+
+    def attach(self, view):
+        with self.lock:
+            stream = self.streams.get(view)
+            if stream is None:
+                stream = self.make_stream(view)
+                if stream is None:
+                    return None
+                self.streams[view] = stream
+            stream.clients += 1
+            self.update_clients()
+            return stream
+
+    def detach(self, view, stream):
+        with self.lock:
+            stream.clients -= 1
+            if stream.clients == 0 and self.streams.get(view) is stream:
+                del self.streams[view]  # Forget the last JPEG too, so an idle viewer holds nothing
+            self.update_clients()
+
+    def update_clients(self):
+        METRICS.set('viewer_clients', '', sum(stream.clients for stream in self.streams.values()))
+
+    def index(self):
+        links = ''.join(f'<li><a href="/camera/{handler.camera_id}">{html.escape(handler.name)}</a></li>'
+                        for handler in list(self.handlers))
+        return (f'<!DOCTYPE html><html><head><title>Cameras</title></head><body>'
+                f'<ul>{links}</ul><img src="/mosaic" alt="mosaic"></body></html>').encode('utf-8')
+
+    def serve(self, port=8080, host='127.0.0.1'):
+        """Serve http://host:port/ from daemon threads; one thread per connected client."""
+        viewer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0].rstrip('/')
+                if path == '':
+                    body = viewer.index()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/html; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                elif path == '/mosaic':
+                    self.stream('mosaic')
+                elif path.startswith('/camera/'):
+                    self.stream(path[len('/camera/'):])
+                else:
+                    self.send_error(404)
+
+            def stream(self, view):
+                stream = viewer.attach(view)
+                if stream is None:
+                    self.send_error(404)
+                    return
+                try:
+                    self.send_response(200)
+                    self.send_header('Content-Type', f'multipart/x-mixed-replace; boundary={BOUNDARY.decode()}')
+                    self.send_header('Cache-Control', 'no-cache')
+                    self.end_headers()
+                    version = 0
+                    while True:
+                        version, jpeg = stream.next(version)
+                        if jpeg is None:
+                            if view != 'mosaic' and viewer.find(view) is None:
+                                break  # The camera was removed from the config
+                            continue  # Nothing new yet; the camera may be reconnecting
+                        self.wfile.write(b'--' + BOUNDARY + b'\r\nContent-Type: image/jpeg\r\nContent-Length: '
+                                         + str(len(jpeg)).encode() + b'\r\n\r\n' + jpeg + b'\r\n')
+                except OSError:
+                    pass  # Client went away
+                finally:
+                    viewer.detach(view, stream)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Serving camera viewer on http://{host}:{server.server_address[1]}/")
+        return server
@@ -0,0 +1,216 @@
+import itertools
+import multiprocessing as mp
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+import numpy as np
+from detector import YOLODetector
+from engine import InferenceRequest
+
+
+def worker_main(task_queue, result_queue, detector_args, num_threads):
+    import cv2 as cv
+    cv.setNumThreads(num_threads)
+    detector = YOLODetector(**detector_args)
+    attached = {}  # camera id -> SharedMemory currently used by that camera
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        if len(task) == 2:  # ('release', camera id): the camera was removed, let go of its frames
+            shm = attached.pop(task[1], None)
+            if shm is not None:
+                shm.close()
+            continue
+        request_id, camera_id, shm_name, slot_size, slot, shape, dtype, inpSize = task
+        shm = attached.get(camera_id)
+        if shm is None or shm.name != shm_name:
+            if shm is not None:
+                shm.close()
+            shm = attached[camera_id] = shared_memory.SharedMemory(name=shm_name)
+
+        frame = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=slot * slot_size)
+        try:
+            result_queue.put((request_id, detector.detect(frame, inpSize), None))
+        except Exception as e:
+            result_queue.put((request_id, None, f"{type(e).__name__}: {e}"))
+        del frame  # Release the buffer export so the block can be closed
+
+    for shm in attached.values():
+        shm.close()
+
+
+class FrameRing:
+    """Fixed set of frame slots in one shared memory block, written round-robin."""
+
+    def __init__(self, slot_size, num_slots=2):
+        self.slot_size = slot_size
+        self.num_slots = num_slots
+        self.shm = shared_memory.SharedMemory(create=True, size=slot_size * num_slots)
+        self.next_slot = 0
+
+    def write(self, frame):
+        slot = self.next_slot
+        self.next_slot = (slot + 1) % self.num_slots
+        view = np.ndarray(frame.shape, dtype=frame.dtype, buffer=self.shm.buf, offset=slot * self.slot_size)
+        np.copyto(view, frame)
+        del view
+        return slot
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class WorkerPool:
+    """Runs detection in worker processes; each camera is pinned to the worker with the fewest cameras.
+
+    Frames are copied into a per-camera FrameRing and only the slot location
+    travels over the task queue. Workers send back the NMS survivors, which
+    are a few small arrays per frame. A request fails instead of hanging
+    when its worker dies or takes longer than timeout seconds; a worker
+    that died is replaced, so its cameras recover with the next frame.
+    """
+
+    def __init__(self, num_workers, ring_slots=2, threads_per_worker=None, timeout=30.0, **detector_args):
+        if threads_per_worker is None:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // num_workers)
+        self.detector_args = detector_args
+        self.ring_slots = ring_slots
+        self.timeout = timeout
+        self.threads_per_worker = threads_per_worker
+        self.ctx = mp.get_context('spawn')
+        self.task_queues = [self.ctx.Queue() for _ in range(num_workers)]
+        # One result queue per worker, so a worker dying halfway through a put can't block the others' results
+        self.result_queues = [self.ctx.Queue() for _ in range(num_workers)]
+        self.processes = [self.worker_process(worker) for worker in range(num_workers)]
+        self.waiting = {}  # request id -> InferenceRequest
+        self.request_ids = itertools.count()
+        self.camera_ids = itertools.count()  # Never reused, so a removed camera's frames can't be mistaken for another's
+        self.lock = threading.Lock()
+        self.detectors = []
+
+    def worker_process(self, worker):
+        return self.ctx.Process(target=worker_main, daemon=True,
+                                args=(self.task_queues[worker], self.result_queues[worker], self.detector_args,
+                                      self.threads_per_worker))
+
+    def start_worker(self, worker):
+        self.processes[worker].start()
+        threading.Thread(target=self.dispatch_results, args=(self.result_queues[worker],), daemon=True).start()
+
+    def start(self):
+        for worker in range(len(self.processes)):
+            self.start_worker(worker)
+        return self
+
+    def respawn(self, worker, process):
+        """Replace worker's dead process, unless a request of another of its cameras already did."""
+        with self.lock:
+            if self.processes[worker] is not process:
+                return
+            print(f"Worker {worker} exited with code {process.exitcode}, starting a new one")
+            # Fresh queues: the dead process may have held the old ones' locks, and its tasks are failed anyway
+            self.task_queues[worker].cancel_join_thread()
+            self.result_queues[worker].cancel_join_thread()
+            self.result_queues[worker].put(None)  # Ends the old queue's dispatch thread
+            self.task_queues[worker] = self.ctx.Queue()
+            self.result_queues[worker] = self.ctx.Queue()
+            self.processes[worker] = self.worker_process(worker)
+            self.start_worker(worker)
+
+    def detector_for_camera(self):
+        with self.lock:
+            camera_id = next(self.camera_ids)
+            # The worker with the fewest cameras, so removed cameras don't leave the pool unbalanced
+            worker = min(range(len(self.processes)), key=lambda w: sum(d.worker == w for d in self.detectors))
+            detector = WorkerDetector(self, camera_id, worker)
+            self.detectors.append(detector)
+        return detector
+
+    def release_detector(self, detector):
+        """Free a camera's frame ring, here and in its worker; the camera must no longer be detecting."""
+        with self.lock:
+            self.detectors.remove(detector)
+        self.task_queues[detector.worker].put(('release', detector.camera_id))
+        if detector.ring is not None:
+            detector.ring.close()
+            detector.ring = None
+
+    def infer(self, camera_id, worker, task):
+        request = InferenceRequest(None)
+        process = self.processes[worker]
+        with self.lock:
+            request_id = next(self.request_ids)
+            self.waiting[request_id] = request
+        self.task_queues[worker].put((request_id, camera_id) + task)
+        deadline = time.monotonic() + self.timeout
+        while not request.done.wait(0.5):
+            if not process.is_alive():
+                error = f"worker process exited with code {process.exitcode}"
+            elif time.monotonic() > deadline:
+                error = f"no result after {self.timeout:.0f} s"
+            else:
+                continue
+            with self.lock:
+                # A result that still turns up later is dropped by dispatch_results
+                lost = self.waiting.pop(request_id, None) is not None
+            if not lost:
+                request.done.wait()  # The result arrived just now
+                break
+            if not process.is_alive():
+                self.respawn(worker, process)
+            raise RuntimeError(f"Worker {worker} failed on camera {camera_id}: {error}")
+        if request.error is not None:
+            raise RuntimeError(f"Worker {worker} failed on camera {camera_id}: {request.error}")
+        return request.detections
+
+    def dispatch_results(self, result_queue):
+        while True:
+            result = result_queue.get()
+            if result is None:
+                break  # The worker was replaced
+            request_id, detections, error = result
+            with self.lock:
+                request = self.waiting.pop(request_id, None)
+            if request is None:
+                continue
+            request.detections = detections
+            request.error = error
+            request.done.set()
+
+    def close(self):
+        for task_queue in self.task_queues:
+            task_queue.put(None)
+        for process in self.processes:
+            process.join()
+        for detector in self.detectors:
+            if detector.ring is not None:
+                detector.ring.close()
+
+
+class WorkerDetector(YOLODetector):
+    """Per-camera detector whose inference runs in the camera's pinned WorkerPool process."""
+
+    def __init__(self, pool, camera_id, worker):
+        self.pool = pool
+        self.camera_id = camera_id
+        self.worker = worker
+        self.ring = None
+        super().__init__(**pool.detector_args)
+
+    def load_net(self, modelConf, modelWeights):
+        return None  # The network only lives in the worker processes
+
+    def detect(self, frame, inpSize=None):
+        if self.ring is None or frame.nbytes > self.ring.slot_size:
+            # First frame, or the stream came back at a higher resolution
+            if self.ring is not None:
+                self.ring.close()
+            self.ring = FrameRing(frame.nbytes, self.pool.ring_slots)
+        slot = self.ring.write(frame)
+        task = (self.ring.shm.name, self.ring.slot_size, slot, frame.shape, frame.dtype.str,
+                inpSize or (self.inpWidth, self.inpHeight))
+        return self.pool.infer(self.camera_id, self.worker, task)
@@ -0,0 +1,128 @@
+import json
+import cv2 as cv
+import numpy as np
+
+
+def rect_polygon(x, y, w, h):
+    return [(x, y), (x + w, y), (x + w, y + h), (x, y + h)]
+
+
+class ZoneSet:
+    """Named polygon zones of one camera, tested against many boxes at once.
+
+    Every zone is rasterised once into a mask over its bounding box and
+    turned into a summed-area table; the tables of all zones share one flat
+    array. The pixel area any box shares with any zone is then four lookups,
+    so overlaps() handles all boxes against all zones in a single gather.
+    """
+
+    def __init__(self, zones, min_overlap=0.0):
+        """zones maps name -> list of (x, y) points; min_overlap is a default or a {name: fraction} dict."""
+        self.names = list(zones)
+        self.polygons = [np.asarray(points, dtype=np.int32).reshape(-1, 2) for points in zones.values()]
+        if not isinstance(min_overlap, dict):
+            min_overlap = {name: min_overlap for name in self.names}
+        self.min_overlap = np.array([min_overlap.get(name, 0.0) for name in self.names], dtype=np.float32)
+        self.scaled_sets = {}
+
+        origins, extents, offsets, tables = [], [], [], []
+        offset = 0
+        for polygon in self.polygons:
+            origin = polygon.min(axis=0)
+            width, height = np.maximum(polygon.max(axis=0) - origin, 1)
+            # Right/bottom edges fall just outside the mask, so a w x h rectangle covers exactly w x h pixels
+            mask = np.zeros((height, width), dtype=np.uint8)
+            cv.fillPoly(mask, [polygon - origin], 1)
+            table = cv.integral(mask)
+            origins.append(origin)
+            extents.append((width, height))
+            offsets.append(offset)
+            tables.append(table.ravel())
+            offset += table.size
+        self.origins = np.array(origins, dtype=np.int64).reshape(-1, 2)
+        self.extents = np.array(extents, dtype=np.int64).reshape(-1, 2)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.tables = np.concatenate(tables) if tables else np.zeros(0, dtype=np.int32)
+        if len(self.polygons):
+            self.bounds = (*map(int, self.origins.min(axis=0)), *map(int, (self.origins + self.extents).max(axis=0)))
+        else:
+            self.bounds = (0, 0, 0, 0)
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_rect(cls, interest_area, name='aoi'):
+        """Single zone from an (x, y, w, h) interest area."""
+        return cls({name: rect_polygon(*interest_area)})
+
+    def overlaps(self, boxes):
+        """Fraction of each left/top/width/height box inside each zone, as an (N, zones) array."""
+        boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 1, 4)
+        left = boxes[..., 0] - self.origins[:, 0]
+        top = boxes[..., 1] - self.origins[:, 1]
+        width, height = self.extents[:, 0], self.extents[:, 1]
+        x1, x2 = np.clip(left, 0, width), np.clip(left + boxes[..., 2], 0, width)
+        y1, y2 = np.clip(top, 0, height), np.clip(top + boxes[..., 3], 0, height)
+        stride = width + 1
+        base = self.offsets
+        area = (self.tables[base + y2 * stride + x2] - self.tables[base + y1 * stride + x2]
+                - self.tables[base + y2 * stride + x1] + self.tables[base + y1 * stride + x1])
+        return area / np.maximum(boxes[..., 2] * boxes[..., 3], 1)
+
+    def test(self, boxes):
+        """Return (overlap fractions, hits) for every box against every zone."""
+        fractions = self.overlaps(boxes)
+        return fractions, (fractions > self.min_overlap) & (fractions > 0)
+
+    def scaled(self, scale):
+        """The same zones in the coordinates of a frame resized by scale; built once per scale."""
+        if scale == 1:
+            return self
+        key = round(scale, 4)
+        if key not in self.scaled_sets:
+            zones = {name: np.round(polygon * scale).astype(np.int32)
+                     for name, polygon in zip(self.names, self.polygons)}
+            self.scaled_sets[key] = ZoneSet(zones, dict(zip(self.names, self.min_overlap.tolist())))
+        return self.scaled_sets[key]
+
+    def draw(self, frame, color=(0, 255, 0), thickness=2):
+        cv.polylines(frame, list(self.polygons), True, color, thickness)
+        for name, polygon in zip(self.names, self.polygons):
+            x, y = polygon.min(axis=0)
+            cv.putText(frame, name, (int(x), max(int(y) - 5, 10)), cv.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+
+
+def draw_interest_area(frame, interest_area, color=(0, 255, 0)):
+    """Draw a ZoneSet or an (x, y, w, h) interest area."""
+    if isinstance(interest_area, ZoneSet):
+        interest_area.draw(frame, color)
+    elif interest_area:
+        x, y, w, h = interest_area
+        cv.rectangle(frame, (x, y), (x + w, y + h), color, 2)
+
+
+def parse_zone(spec):
+    """Points of a zone given as a list of [x, y] points or a {"rect": [x, y, w, h]} / {"points": [...]} dict."""
+    if isinstance(spec, dict):
+        if 'rect' in spec:
+            return rect_polygon(*spec['rect'])
+        return spec['points']
+    return spec
+
+
+def load_zones(path):
+    """Read a zones file: {camera: {zone name: zone}} where camera is the stream URL or its row number.
+
+    The row number counts the cameras in the CSV from 0, skipping comments.
+    A zone is a list of [x, y] points, or a dict with "points" or "rect"
+    and an optional "min_overlap" fraction of the box that must be inside.
+    Returns {camera: ZoneSet}.
+    """
+    with open(path, 'rt') as f:
+        config = json.load(f)
+    zone_sets = {}
+    for camera, zones in config.items():
+        min_overlap = {name: spec.get('min_overlap', 0.0) for name, spec in zones.items() if isinstance(spec, dict)}
+        zone_sets[camera] = ZoneSet({name: parse_zone(spec) for name, spec in zones.items()}, min_overlap)
+    return zone_sets